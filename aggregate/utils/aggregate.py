@@ -19,6 +19,8 @@ BASE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
 
 pattern = re.compile("(.*)pageviews_([0-9]+).csv")
 ua_cache = {}
+# number of statements psycopg2 sends to the server in a single round trip
+EXECUTE_BATCH_PAGE_SIZE = 1000
 
 
 def add_one(arr, key):
@@ -109,22 +111,40 @@ def aggregated_pageviews_row_accessors(accessors_to_merge=None):
 
 
 def make_insert_update_sql(table, primary_keys, keys):
+    # placeholders are numbered ($1, $2, ...) as the statement is meant to be prepared, see execute_prepared_batch
+    parameter_count = len(primary_keys) + len(keys)
     concatenated_primary_keys = string.join(primary_keys, ', ')
     all_keys = string.join(primary_keys + keys, ', ')
-    all_key_placeholders = string.join(['%s'] * (len(primary_keys) + len(keys)), ', ')
+    all_key_placeholders = string.join(['$' + str(i + 1) for i in range(parameter_count)], ', ')
     update_keys = string.join(["{} = EXCLUDED.{}".format(key, key) for key in keys], ', ')
 
     if len(keys) > 0:
-        return '''INSERT INTO {} ({}) 
+        sql = '''INSERT INTO {} ({}) 
                         VALUES ({}) 
                         ON CONFLICT ({}) DO UPDATE SET {}
                     '''.format(table, all_keys, all_key_placeholders, concatenated_primary_keys, update_keys)
     else:
-        return '''INSERT INTO {} ({}) 
+        sql = '''INSERT INTO {} ({}) 
                         VALUES ({}) 
                         ON CONFLICT ({}) DO NOTHING
                     '''.format(table, all_keys, all_key_placeholders, concatenated_primary_keys)
 
+    return sql, parameter_count
+
+
+def execute_prepared_batch(cur, name, sql, parameter_count, rows):
+    # statement is parsed and planned only once on the server, rows are then sent as batches of EXECUTE calls
+    cur.execute('PREPARE ' + name + ' AS ' + sql)
+    try:
+        psycopg2.extras.execute_batch(cur, 'EXECUTE ' + name + ' (' + string.join(['%s'] * parameter_count, ', ') + ')',
+                                      rows, page_size=EXECUTE_BATCH_PAGE_SIZE)
+    finally:
+        # prepared statements outlive transactions, an aborted transaction has to be rolled back before the statement
+        # can be deallocated, otherwise a retry on the same connection fails on the statement already existing
+        if cur.connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            cur.connection.rollback()
+        cur.execute('DEALLOCATE ' + name)
+
 
 class UserParser:
     def __init__(self):
@@ -184,9 +204,10 @@ class UserParser:
             'aggregated_user_days_referer_mediums'
         ]
 
-        for t in tables_to_del:
-            cur.execute('DELETE FROM ' + t + ' WHERE date = %s', (processed_date,))
-            conn.commit()
+        # all deletes are sent to the server in a single round trip
+        cur.execute(string.join(['DELETE FROM ' + t + ' WHERE date = %(date)s;' for t in tables_to_del], ' '),
+                    {'date': processed_date})
+        conn.commit()
 
         print("Storing data for date " + str(processed_date))
 
@@ -201,47 +222,47 @@ class UserParser:
         })
 
         ordered_accessors = OrderedDict([(key, accessors[key]) for key in accessors])
-        sql = make_insert_update_sql('aggregated_user_days', ['date', 'user_id'], list(ordered_accessors.keys()))
+        sql, parameter_count = make_insert_update_sql('aggregated_user_days', ['date', 'user_id'], list(ordered_accessors.keys()))
 
         data_to_insert = []
         for user_id, user_data in self.data.items():
             computed_values = tuple([func(user_data) for key, func in ordered_accessors.items()])
             data_to_insert.append((processed_date, user_id) + computed_values)
 
-        psycopg2.extras.execute_batch(cur, sql, data_to_insert)
+        execute_prepared_batch(cur, 'upsert_aggregated_user_days', sql, parameter_count, data_to_insert)
         conn.commit()
 
     def __save_to_aggregated_user_days_tags(self, conn, cur, processed_date):
-        sql = make_insert_update_sql('aggregated_user_days_tags', ['date', 'user_id', 'tags'], ['pageviews'])
+        sql, parameter_count = make_insert_update_sql('aggregated_user_days_tags', ['date', 'user_id', 'tags'], ['pageviews'])
 
         data_to_insert = []
         for user_id, user_data in self.data.items():
             for key in user_data['article_tags_pageviews']:
                 data_to_insert.append((processed_date, user_id, key, user_data['article_tags_pageviews'][key]))
 
-        psycopg2.extras.execute_batch(cur, sql, data_to_insert)
+        execute_prepared_batch(cur, 'upsert_aggregated_user_days_tags', sql, parameter_count, data_to_insert)
         conn.commit()
 
     def __save_to_aggregated_user_days_categories(self, conn, cur, processed_date):
-        sql = make_insert_update_sql('aggregated_user_days_categories', ['date', 'user_id', 'categories'], ['pageviews'])
+        sql, parameter_count = make_insert_update_sql('aggregated_user_days_categories', ['date', 'user_id', 'categories'], ['pageviews'])
 
         data_to_insert = []
         for user_id, user_data in self.data.items():
             for key in user_data['article_categories_pageviews']:
                 data_to_insert.append((processed_date, user_id, key, user_data['article_categories_pageviews'][key]))
 
-        psycopg2.extras.execute_batch(cur, sql, data_to_insert)
+        execute_prepared_batch(cur, 'upsert_aggregated_user_days_categories', sql, parameter_count, data_to_insert)
         conn.commit()
 
     def __save_to_aggregated_user_days_referer_mediums(self, conn, cur, processed_date):
-        sql = make_insert_update_sql('aggregated_user_days_referer_mediums', ['date', 'user_id', 'referer_mediums'], ['pageviews'])
+        sql, parameter_count = make_insert_update_sql('aggregated_user_days_referer_mediums', ['date', 'user_id', 'referer_mediums'], ['pageviews'])
 
         data_to_insert = []
         for user_id, user_data in self.data.items():
             for key in user_data['referer_mediums_pageviews']:
                 data_to_insert.append((processed_date, user_id, key, user_data['referer_mediums_pageviews'][key]))
 
-        psycopg2.extras.execute_batch(cur, sql, data_to_insert)
+        execute_prepared_batch(cur, 'upsert_aggregated_user_days_referer_mediums', sql, parameter_count, data_to_insert)
         conn.commit()
 
 
@@ -321,8 +342,8 @@ class BrowserParser:
         }
 
         ordered_accessors = OrderedDict([(key, accessors[key]) for key in accessors])
-        sql_browsers = make_insert_update_sql('browsers', ['date', 'browser_id'], list(ordered_accessors.keys()))
-        sql_browser_users = make_insert_update_sql('browser_users', ['date', 'browser_id', 'user_id'], [])
+        sql_browsers, browsers_parameter_count = make_insert_update_sql('browsers', ['date', 'browser_id'], list(ordered_accessors.keys()))
+        sql_browser_users, browser_users_parameter_count = make_insert_update_sql('browser_users', ['date', 'browser_id', 'user_id'], [])
 
         browsers_to_insert = []
         browser_users_to_insert = []
@@ -333,10 +354,10 @@ class BrowserParser:
             for user_id in list(browser_data['user_ids']):
                 browser_users_to_insert.append((processed_date, browser_id, user_id))
 
-        psycopg2.extras.execute_batch(cur, sql_browsers, browsers_to_insert)
+        execute_prepared_batch(cur, 'upsert_browsers', sql_browsers, browsers_parameter_count, browsers_to_insert)
         conn.commit()
 
-        psycopg2.extras.execute_batch(cur, sql_browser_users, browser_users_to_insert)
+        execute_prepared_batch(cur, 'upsert_browser_users', sql_browser_users, browser_users_parameter_count, browser_users_to_insert)
         conn.commit()
 
     def __save_to_aggregated_browser_days(self, conn, cur, processed_date):
@@ -355,47 +376,47 @@ class BrowserParser:
         })
 
         ordered_accessors = OrderedDict([(key, accessors[key]) for key in accessors])
-        sql = make_insert_update_sql('aggregated_browser_days', ['date', 'browser_id'], list(ordered_accessors.keys()))
+        sql, parameter_count = make_insert_update_sql('aggregated_browser_days', ['date', 'browser_id'], list(ordered_accessors.keys()))
 
         data_to_insert = []
         for browser_id, browser_data in self.data.items():
             computed_values = tuple([func(browser_data) for key, func in ordered_accessors.items()])
             data_to_insert.append((processed_date, browser_id) + computed_values)
 
-        psycopg2.extras.execute_batch(cur, sql, data_to_insert)
+        execute_prepared_batch(cur, 'upsert_aggregated_browser_days', sql, parameter_count, data_to_insert)
         conn.commit()
 
     def __save_to_aggregated_browser_days_tags(self, conn, cur, processed_date):
-        sql = make_insert_update_sql('aggregated_browser_days_tags', ['date', 'browser_id', 'tags'], ['pageviews'])
+        sql, parameter_count = make_insert_update_sql('aggregated_browser_days_tags', ['date', 'browser_id', 'tags'], ['pageviews'])
 
         data_to_insert = []
         for browser_id, browser_data in self.data.items():
             for key in browser_data['article_tags_pageviews']:
                 data_to_insert.append((processed_date, browser_id, key, browser_data['article_tags_pageviews'][key]))
 
-        psycopg2.extras.execute_batch(cur, sql, data_to_insert)
+        execute_prepared_batch(cur, 'upsert_aggregated_browser_days_tags', sql, parameter_count, data_to_insert)
         conn.commit()
 
     def __save_to_aggregated_browser_days_categories(self, conn, cur, processed_date):
-        sql = make_insert_update_sql('aggregated_browser_days_categories', ['date', 'browser_id', 'categories'], ['pageviews'])
+        sql, parameter_count = make_insert_update_sql('aggregated_browser_days_categories', ['date', 'browser_id', 'categories'], ['pageviews'])
 
         data_to_insert = []
         for browser_id, browser_data in self.data.items():
             for key in browser_data['article_categories_pageviews']:
                 data_to_insert.append((processed_date, browser_id, key, browser_data['article_categories_pageviews'][key]))
 
-        psycopg2.extras.execute_batch(cur, sql, data_to_insert)
+        execute_prepared_batch(cur, 'upsert_aggregated_browser_days_categories', sql, parameter_count, data_to_insert)
         conn.commit()
 
     def __save_to_aggregated_browser_days_referer_mediums(self, conn, cur, processed_date):
-        sql = make_insert_update_sql('aggregated_browser_days_referer_mediums', ['date', 'browser_id', 'referer_mediums'], ['pageviews'])
+        sql, parameter_count = make_insert_update_sql('aggregated_browser_days_referer_mediums', ['date', 'browser_id', 'referer_mediums'], ['pageviews'])
 
         data_to_insert = []
         for browser_id, browser_data in self.data.items():
             for key in browser_data['referer_mediums_pageviews']:
                 data_to_insert.append((processed_date, browser_id, key, browser_data['referer_mediums_pageviews'][key]))
 
-        psycopg2.extras.execute_batch(cur, sql, data_to_insert)
+        execute_prepared_batch(cur, 'upsert_aggregated_browser_days_referer_mediums', sql, parameter_count, data_to_insert)
         conn.commit()
 
     def store_in_db(self, conn, cur, processed_date):
@@ -410,9 +431,10 @@ class BrowserParser:
             'aggregated_browser_days_referer_mediums'
         ]
 
-        for t in tables_to_del:
-            cur.execute('DELETE FROM ' + t + ' WHERE date = %s', (processed_date,))
-            conn.commit()
+        # all deletes are sent to the server in a single round trip
+        cur.execute(string.join(['DELETE FROM ' + t + ' WHERE date = %(date)s;' for t in tables_to_del], ' '),
+                    {'date': processed_date})
+        conn.commit()
 
         print("Storing data for date " + str(processed_date))
 
@@ -5,156 +5,194 @@ import psycopg2.extras
 import os.path
 import arrow
 import argparse
-from datetime import date
+from datetime import date, timedelta
+from operator import itemgetter
 from utils import load_env, create_con, migrate
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 BASE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
 
-class Commerce:
-    def __init__(self, row):
-        self.browser_id = row['browser_id']
-        self.time = row['time']
-        self.user_id = row['user_id']
-        self.step = row['step']
+# number of rows buffered in memory before flushing them to postgres via COPY
+COPY_CHUNK_SIZE = 100000
+
+
+def _copy_value(value):
+    # escaping according to PostgreSQL COPY text format rules
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _copy_rows(cur, table, columns, rows):
+    sql = "COPY " + table + " (" + ", ".join(columns) + ") FROM STDIN WITH (FORMAT text)"
+    buf = StringIO()
+    buffered = 0
+    for row in rows:
+        buf.write("\t".join(_copy_value(value) for value in row) + "\n")
+        buffered += 1
+        if buffered == COPY_CHUNK_SIZE:
+            buf.seek(0)
+            cur.copy_expert(sql, buf)
+            buf = StringIO()
+            buffered = 0
+    if buffered:
+        buf.seek(0)
+        cur.copy_expert(sql, buf)
+
+
+def _copy_events(cur, rows):
+    _copy_rows(cur, 'events', ['user_id', 'browser_id', 'time', 'type', 'computed_for'], rows)
+
+
+def _mark_next_7_days_event(cur, cur_date, event_type, browser_event_times):
+    # browser_event_times are (browser_id, event_time) pairs, they are staged in a temporary table via COPY
+    # so that both statements below are single set-based joins regardless of number of browsers
+    cur.execute('''
+        CREATE TEMPORARY TABLE next_7_days_event_staging (
+            "browser_id" character varying NOT NULL,
+            "next_event_time" timestamp NOT NULL
+        )
+    ''')
+    _copy_rows(cur, 'next_7_days_event_staging', ['browser_id', 'next_event_time'], browser_event_times)
+
+    # first delete that particular day
+    # we don't want event day to be included in aggregated data
+    cur.execute('''
+        DELETE FROM aggregated_browser_days a
+        USING next_7_days_event_staging s
+        WHERE a.date = %s AND a.browser_id = s.browser_id
+    ''', (cur_date,))
+
+    # then mark 7_days_event for 7 previous days, the earliest event of a browser wins
+    end = cur_date - timedelta(days=1)
+    start = end - timedelta(days=6)
+    cur.execute('''
+        UPDATE aggregated_browser_days a
+        SET next_7_days_event = %s, next_event_time = s.next_event_time
+        FROM (
+            SELECT DISTINCT ON (browser_id) browser_id, next_event_time
+            FROM next_7_days_event_staging
+            ORDER BY browser_id, next_event_time
+        ) s
+        WHERE a.browser_id = s.browser_id AND a.date BETWEEN %s AND %s AND a.next_7_days_event = 'no_conversion'
+    ''', (event_type, start, end))
 
-    def __str__(self):
-        return "[" + self.step + "|" + self.browser_id + "|" + self.time + "|" + self.user_id + "]"
+    cur.execute('DROP TABLE next_7_days_event_staging')
 
-    def __repr__(self):
-        return self.__str__()
+
+def _read_csv_rows(f):
+    # rows are streamed one by one so callers only keep in memory what they actually need
+    with open(f) as csv_file:
+        for row in csv.DictReader(csv_file, delimiter=','):
+            yield row
 
 
 class CommerceParser:
     def __init__(self, cur_date, cursor):
-        self.user_id_payment_time = {}
-        self.user_id_browser_id = {}
+        self.user_id_last_payment = {}
         self.data = []
         self.cur_date = cur_date
         self.cursor = cursor
         self.browser_steps = {}
         self.events_to_save = []
+        self.conversions = []
         pass
 
     def __load_data(self, commerce_file):
-        with open(commerce_file) as csv_file:
-            r = csv.DictReader(csv_file, delimiter=',')
-            for row in r:
-                self.data.append(Commerce(row))
-
-                if row['browser_id']:
-                    if row['browser_id'] not in self.browser_steps:
-                        self.browser_steps[row['browser_id']] = {
-                            'checkout': 0,
-                            'payment': 0,
-                            'purchase': 0,
-                            'refund': 0
-                        }
-
-                    if row['step'] not in ['checkout', 'payment', 'purchase', 'refund']:
-                        raise Exception("unknown commerce step: " + row['step'] + ' for browser_id: ' + row['browser_id'])
-                    else:
-                        self.browser_steps[row['browser_id']][row['step']] += 1
+        for row in _read_csv_rows(commerce_file):
+            if row['browser_id']:
+                if row['browser_id'] not in self.browser_steps:
+                    self.browser_steps[row['browser_id']] = {
+                        'checkout': 0,
+                        'payment': 0,
+                        'purchase': 0,
+                        'refund': 0
+                    }
+
+                if row['step'] not in ['checkout', 'payment', 'purchase', 'refund']:
+                    raise Exception("unknown commerce step: " + row['step'] + ' for browser_id: ' + row['browser_id'])
+                else:
+                    self.browser_steps[row['browser_id']][row['step']] += 1
 
-    def __save_events_to_separate_table(self):
-        sql = '''
-            INSERT INTO events (user_id, browser_id, time, type, computed_for)
-            VALUES (%s, %s, %s, %s, %s)
-        '''
+            # only payments and purchases take part in conversion matching
+            # rows are kept as (time, step, browser_id, user_id) tuples
+            if (row['step'] == 'payment' and row['browser_id'] and row['user_id']) or \
+                    (row['step'] == 'purchase' and row['user_id']):
+                self.data.append((row['time'], row['step'], row['browser_id'], row['user_id']))
 
-        psycopg2.extras.execute_batch(self.cursor, sql, [
+    def __save_events_to_separate_table(self):
+        _copy_events(self.cursor, (
             (x["user_id"], x["browser_id"], x["time"], x["type"], self.cur_date) for x in self.events_to_save
-        ])
-        self.cursor.connection.commit()
+        ))
 
     def process_file(self, commerce_file):
         print("Processing file: " + commerce_file)
         self.__load_data(commerce_file)
-        self.data.sort(key=lambda x: x.time)
-
-        for c in self.data:
-            if c.step == 'payment' and c.browser_id and c.user_id:
-                self.user_id_payment_time[c.user_id] = arrow.get(c.time)
-                self.user_id_browser_id[c.user_id] = c.browser_id
-            elif c.step == 'purchase' and c.user_id:
-                purchase_time = arrow.get(c.time)
-                purchase_time_minus_5 = purchase_time.shift(minutes=-5)
-
-                if c.user_id not in self.user_id_payment_time:
-                    continue
-
-                payment_time = self.user_id_payment_time[c.user_id]
-
-                # purchase event too far from payment event
-                if purchase_time_minus_5 <= payment_time:
-                    browser_id = self.user_id_browser_id[c.user_id]
-                    self.__mark_conversion_event(browser_id, purchase_time)
-                    self.events_to_save.append({
-                        "user_id": c.user_id,
-                        "browser_id": browser_id,
-                        "time": c.time,
-                        "type": "conversion",
-                    })
-
+        self.data.sort(key=itemgetter(0))
+
+        # each purchase is matched with the latest preceding payment of the same user (as-of join)
+        for time, step, browser_id, user_id in self.data:
+            if step == 'payment':
+                # times are parsed only once a payment is matched by a purchase
+                self.user_id_last_payment[user_id] = (time, browser_id)
+                continue
+
+            last_payment = self.user_id_last_payment.get(user_id)
+            if last_payment is None:
+                continue
+
+            payment_time, payment_browser_id = last_payment
+            purchase_time = arrow.get(time)
+
+            # purchase event too far from payment event
+            if purchase_time.shift(minutes=-5) <= arrow.get(payment_time):
+                self.conversions.append((payment_browser_id, purchase_time))
+                self.events_to_save.append({
+                    "user_id": user_id,
+                    "browser_id": payment_browser_id,
+                    "time": time,
+                    "type": "conversion",
+                })
+
+        self.__mark_conversion_events()
         self.__save_events_to_separate_table()
         self.__save_commerce_steps_count()
 
     def __save_commerce_steps_count(self):
         sql = '''
-            UPDATE aggregated_browser_days
-            SET commerce_checkouts = %s, commerce_payments = %s, commerce_purchases = %s, commerce_refunds = %s
-            WHERE date = %s AND browser_id = %s
+            UPDATE aggregated_browser_days a
+            SET commerce_checkouts = v.checkouts, commerce_payments = v.payments, commerce_purchases = v.purchases,
+                commerce_refunds = v.refunds
+            FROM (VALUES %s) AS v(date, browser_id, checkouts, payments, purchases, refunds)
+            WHERE a.date = v.date AND a.browser_id = v.browser_id
         '''
 
-        psycopg2.extras.execute_batch(self.cursor, sql, [
-            (self.browser_steps[browser_id]['checkout'],
+        psycopg2.extras.execute_values(self.cursor, sql, [
+            (self.cur_date.isoformat(),
+             browser_id,
+             self.browser_steps[browser_id]['checkout'],
              self.browser_steps[browser_id]['payment'],
              self.browser_steps[browser_id]['purchase'],
-             self.browser_steps[browser_id]['refund'],
-             self.cur_date.isoformat(),
-             browser_id) for browser_id in self.browser_steps
-        ])
-        self.cursor.connection.commit()
-
-    def __mark_conversion_event(self, browser_id, purchase_time):
-        # first delete that particular day
-        # we don't want conversion day to be included in aggregated data
-        self.cursor.execute('''
-            DELETE FROM aggregated_browser_days WHERE browser_id = %s and date = %s
-        ''', (browser_id, self.cur_date))
-
-        # then mark 7_days_event to 'conversion'
-        # for 7 previous days
-        end = arrow.get(self.cur_date).shift(days=-1)
-        start = end.shift(days=-6)
-        sql = '''
-            UPDATE aggregated_browser_days 
-            SET next_7_days_event = 'conversion', next_event_time = %s
-            WHERE date = %s AND browser_id = %s AND next_7_days_event = 'no_conversion'
-        '''
-        psycopg2.extras.execute_batch(self.cursor, sql, [
-            (purchase_time.isoformat(), day[0].date(), browser_id) for day in arrow.Arrow.span_range('day', start, end)
-        ])
-        self.cursor.connection.commit()
-
-
-class PageView:
-    def __init__(self, row):
-        self.browser_id = row['browser_id']
-        self.user_id = row['user_id']
-        self.time = row['time']
-        self.subscriber = row['subscriber'] == 'True'
+             self.browser_steps[browser_id]['refund']) for browser_id in self.browser_steps
+        ], template="(%s::date, %s, %s, %s, %s, %s)", page_size=1000)
 
-    def __str__(self):
-        return "[" + self.time + "|" + self.browser_id + "|" + self.user_id + "|" + str(self.subscriber) + "]"
+    def __mark_conversion_events(self):
+        if not self.conversions:
+            return
 
-    def __repr__(self):
-        return self.__str__()
+        _mark_next_7_days_event(self.cursor, self.cur_date, 'conversion', (
+            (browser_id, purchase_time.isoformat()) for browser_id, purchase_time in self.conversions
+        ))
 
 
 class SharedLoginParser:
     def __init__(self, cur_date, cursor):
-        self.data = []
-        self.not_logged_in_browsers = set()
+        self.first_not_logged_in_pageview = {}
+        self.last_logged_in_pageview = {}
         self.logged_in_browsers = set()
         self.logged_in_browsers_time = {}
         self.browser_user_id = {}
@@ -162,11 +200,7 @@ class SharedLoginParser:
         self.cursor = cursor
 
     def __save_events_to_separate_table(self):
-        sql = '''
-            INSERT INTO events (user_id, browser_id, time, type, computed_for)
-            VALUES (%s, %s, %s, %s, %s)
-        '''
-        psycopg2.extras.execute_batch(self.cursor, sql, [
+        _copy_events(self.cursor, (
             (
                 self.browser_user_id[browser_id],
                 browser_id,
@@ -175,60 +209,47 @@ class SharedLoginParser:
                 self.cur_date
             )
             for browser_id in self.logged_in_browsers
-        ])
-        self.cursor.connection.commit()
+        ))
 
     def __load_data(self, f):
-        with open(f) as csv_file:
-            r = csv.DictReader(csv_file, delimiter=',')
-            for row in r:
-                self.data.append(PageView(row))
+        # pageviews are aggregated per browser while streaming, (time, row number) keys order them the same way
+        # as sorting rows by time would; pageviews of logged-in non-subscribers are irrelevant for login detection
+        for row_number, row in enumerate(_read_csv_rows(f)):
+            browser_id = row['browser_id']
+            key = (row['time'], row_number)
+            subscriber = row['subscriber'] == 'True'
+            if not subscriber and not row['user_id']:
+                first_pageview = self.first_not_logged_in_pageview.get(browser_id)
+                if first_pageview is None or key < first_pageview:
+                    self.first_not_logged_in_pageview[browser_id] = key
+            elif subscriber and row['user_id']:
+                last_pageview = self.last_logged_in_pageview.get(browser_id)
+                if last_pageview is None or key > last_pageview[0]:
+                    self.last_logged_in_pageview[browser_id] = (key, row['user_id'])
 
     def __find_login_events(self):
-        for p in self.data:
-            if not p.subscriber and not p.user_id:
-                self.not_logged_in_browsers.add(p.browser_id)
-            elif p.subscriber and p.user_id:
-                # this represents an event where user has logged in that particular day
-                logged_in_time = arrow.get(p.time)
-                if p.browser_id in self.not_logged_in_browsers:
-                    self.logged_in_browsers.add(p.browser_id)
-                    self.logged_in_browsers_time[p.browser_id] = logged_in_time
-                else:
-                    # correct earlier timestamp event
-                    if (p.browser_id in self.logged_in_browsers_time and logged_in_time < self.logged_in_browsers_time[p.browser_id]) or p.browser_id not in self.logged_in_browsers_time:
-                        self.logged_in_browsers_time[p.browser_id] = logged_in_time
-                self.browser_user_id[p.browser_id] = p.user_id
+        # this represents an event where user has logged in that particular day - browser's subscriber pageview
+        # follows its not-logged-in pageview, the latest subscriber pageview of the browser is stored with the event
+        for browser_id, (key, user_id) in self.last_logged_in_pageview.items():
+            first_pageview = self.first_not_logged_in_pageview.get(browser_id)
+            if first_pageview is not None and first_pageview < key:
+                self.logged_in_browsers.add(browser_id)
+                self.logged_in_browsers_time[browser_id] = arrow.get(key[0])
+                self.browser_user_id[browser_id] = user_id
 
     def __save_in_db(self):
         print("Storing login data for date " + str(self.cur_date))
 
-        # first delete that particular day
-        for browser_id in self.logged_in_browsers:
-            self.cursor.execute('''
-            DELETE FROM aggregated_browser_days WHERE browser_id = %s and date = %s
-            ''', (browser_id, self.cur_date))
+        if not self.logged_in_browsers:
+            return
 
-        # then mark 7_days_event
-        end = arrow.get(self.cur_date).shift(days=-1)
-        start = end.shift(days=-6)
-
-        sql = '''
-        UPDATE aggregated_browser_days 
-        SET next_7_days_event = 'shared_account_login', next_event_time = %s
-        WHERE date = %s AND browser_id = %s AND next_7_days_event = 'no_conversion'
-        '''
-        psycopg2.extras.execute_batch(self.cursor, sql, [
-            (self.logged_in_browsers_time[browser_id].isoformat(), day[0].date(), browser_id)
-            for day in arrow.Arrow.span_range('day', start, end)
-            for browser_id in self.logged_in_browsers
-        ])
-        self.cursor.connection.commit()
+        _mark_next_7_days_event(self.cursor, self.cur_date, 'shared_account_login', (
+            (browser_id, self.logged_in_browsers_time[browser_id].isoformat()) for browser_id in self.logged_in_browsers
+        ))
 
     def process_file(self, pageviews_file):
         print("Processing file: " + pageviews_file)
         self.__load_data(pageviews_file)
-        self.data.sort(key=lambda x: x.time)
         self.__find_login_events()
         self.__save_in_db()
         self.__save_events_to_separate_table()
@@ -256,12 +277,20 @@ def run(file_date, aggregate_folder):
     migrate(cur)
     conn.commit()
 
+    # The whole day is processed in a single transaction, settings below are tuned for bulk loading
+    # and are valid only until the final commit
+    cur.execute('''
+        SET LOCAL synchronous_commit = OFF;
+        SET LOCAL work_mem = '128MB';
+        SET LOCAL maintenance_work_mem = '512MB';
+        SET LOCAL temp_buffers = '64MB';
+    ''')
+
     event_types = ['conversion', 'shared_account_login']
     # Delete events for particular day (so command can be safely run multiple times)
     cur.execute('''
         DELETE FROM events WHERE computed_for = %s AND type = ANY(%s)
     ''', (cur_date, event_types))
-    conn.commit()
 
     commerce_parser = CommerceParser(cur_date, cur)
     commerce_parser.process_file(commerce_file)
@@ -269,6 +298,7 @@ def run(file_date, aggregate_folder):
     pageviews_parser= SharedLoginParser(cur_date, cur)
     pageviews_parser.process_file(pageviews_file)
 
+    conn.commit()
     cur.close()
     conn.close()
 
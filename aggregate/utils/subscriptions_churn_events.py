@@ -1,7 +1,6 @@
 from __future__ import print_function
 import os.path
 import argparse
-import arrow
 import mysql.connector
 import psycopg2
 import psycopg2.extras
@@ -59,8 +58,10 @@ def churn_or_renewed_users(cursor, subscriptions_stop_date, churn_days_threshold
 
 
 def save_events_to_aggregated_user_days(cursor, subscriptions_stop_date, churn_events, event_name):
-    end = arrow.get(subscriptions_stop_date).shift(days=-1)
-    start = end.shift(days=-29)
+    end = subscriptions_stop_date - timedelta(days=1)
+    start = end - timedelta(days=29)
+    # dates of the whole window are computed only once, not for every event
+    window_days = [start + timedelta(days=d) for d in range(30)]
 
     print("Marking days " + start.strftime("%Y-%m-%d") + " - " + end.strftime("%Y-%m-%d"))
 
@@ -70,9 +71,9 @@ def save_events_to_aggregated_user_days(cursor, subscriptions_stop_date, churn_e
     WHERE date = %s AND user_id = %s AND next_30_days = 'ongoing'
     '''
     psycopg2.extras.execute_batch(cursor, sql, [
-        (event_name, event.time.isoformat(), day[0].date(), event.user_id)
+        (event_name, event.time.isoformat(), day, event.user_id)
         for event in churn_events
-        for day in arrow.Arrow.span_range('day', start, end)
+        for day in window_days
     ])
     cursor.connection.commit()
 
@@ -0,0 +1,111 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+import arrow
+from conversion_and_commerce_events import SharedLoginParser
+
+PAGEVIEW_COLUMNS = ['browser_id', 'user_id', 'time', 'subscriber']
+
+
+def find_login_events_by_sorting(rows):
+    # Previous implementation sorting all of the pageviews by time, kept as the reference for the streamed one
+    not_logged_in_browsers = set()
+    logged_in_browsers = set()
+    logged_in_browsers_time = {}
+    browser_user_id = {}
+    for row in sorted(rows, key=lambda x: x['time']):
+        subscriber = row['subscriber'] == 'True'
+        if not subscriber and not row['user_id']:
+            not_logged_in_browsers.add(row['browser_id'])
+        elif subscriber and row['user_id']:
+            logged_in_time = arrow.get(row['time'])
+            if row['browser_id'] in not_logged_in_browsers:
+                logged_in_browsers.add(row['browser_id'])
+                logged_in_browsers_time[row['browser_id']] = logged_in_time
+            elif row['browser_id'] not in logged_in_browsers_time \
+                    or logged_in_time < logged_in_browsers_time[row['browser_id']]:
+                logged_in_browsers_time[row['browser_id']] = logged_in_time
+            browser_user_id[row['browser_id']] = row['user_id']
+
+    return dict(
+        (browser_id, (logged_in_browsers_time[browser_id], browser_user_id[browser_id]))
+        for browser_id in logged_in_browsers
+    )
+
+
+def pageview(browser_id, user_id, time, subscriber):
+    return {'browser_id': browser_id, 'user_id': user_id, 'time': time, 'subscriber': str(subscriber)}
+
+
+class SharedLoginParserTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def find_login_events(self, rows):
+        pageviews_file = os.path.join(self.tmp_dir, 'pageviews.csv')
+        with open(pageviews_file, 'w') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=PAGEVIEW_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+        parser = SharedLoginParser('2020-01-14', None)
+        parser._SharedLoginParser__load_data(pageviews_file)
+        parser._SharedLoginParser__find_login_events()
+
+        return dict(
+            (browser_id, (parser.logged_in_browsers_time[browser_id], parser.browser_user_id[browser_id]))
+            for browser_id in parser.logged_in_browsers
+        )
+
+    def assert_same_login_events(self, rows):
+        self.assertEqual(find_login_events_by_sorting(rows), self.find_login_events(rows))
+
+    def test_login_after_not_logged_in_pageview(self):
+        self.assert_same_login_events([
+            pageview('b1', '', '2020-01-14T10:00:00Z', False),
+            pageview('b1', 'u1', '2020-01-14T11:00:00Z', True),
+            pageview('b1', 'u1', '2020-01-14T12:00:00Z', True),
+            pageview('b2', '', '2020-01-14T09:00:00Z', False),
+        ])
+
+    def test_rows_out_of_time_order(self):
+        self.assert_same_login_events([
+            pageview('b1', 'u1', '2020-01-14T12:00:00Z', True),
+            pageview('b2', 'u2', '2020-01-14T08:00:00Z', True),
+            pageview('b1', '', '2020-01-14T10:00:00Z', False),
+            pageview('b2', '', '2020-01-14T09:00:00Z', False),
+        ])
+
+    def test_subscriber_pageviews_before_not_logged_in_one(self):
+        self.assert_same_login_events([
+            pageview('b1', 'u1', '2020-01-14T08:00:00Z', True),
+            pageview('b1', '', '2020-01-14T10:00:00Z', False),
+            pageview('b1', 'u2', '2020-01-14T11:00:00Z', True),
+            pageview('b2', 'u3', '2020-01-14T08:00:00Z', True),
+            pageview('b2', '', '2020-01-14T10:00:00Z', False),
+        ])
+
+    def test_pageviews_with_the_same_time(self):
+        self.assert_same_login_events([
+            pageview('b1', '', '2020-01-14T10:00:00Z', False),
+            pageview('b1', 'u1', '2020-01-14T10:00:00Z', True),
+            pageview('b2', 'u2', '2020-01-14T10:00:00Z', True),
+            pageview('b2', '', '2020-01-14T10:00:00Z', False),
+        ])
+
+    def test_logged_in_non_subscriber_pageviews_are_ignored(self):
+        self.assert_same_login_events([
+            pageview('b1', '', '2020-01-14T10:00:00Z', False),
+            pageview('b1', 'u1', '2020-01-14T11:00:00Z', False),
+            pageview('b1', 'u1', '2020-01-14T12:00:00Z', True),
+            pageview('b1', 'u1', '2020-01-14T13:00:00Z', False),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
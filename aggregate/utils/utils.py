@@ -333,5 +333,12 @@ CREATE TABLE IF NOT EXISTS "public"."aggregated_user_days" (
 
 
 
+    # partial index matching the predicate of next_7_days_event updates (browsers without any event yet)
+    sql = '''
+        CREATE INDEX IF NOT EXISTS idx_aggregated_browser_days_no_conversion ON "public"."aggregated_browser_days"(browser_id, date)
+        WHERE next_7_days_event = 'no_conversion';
+        '''
+    cur.execute(sql)
+
 
 
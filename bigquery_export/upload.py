@@ -1,13 +1,75 @@
 from google.cloud import bigquery
 from google.cloud.exceptions import NotFound
-from google.api_core.exceptions import BadRequest
+from google.api_core import retry
+from google.api_core.exceptions import Conflict, GoogleAPICallError, InternalServerError, ServiceUnavailable, \
+    TooManyRequests
+from concurrent.futures import ThreadPoolExecutor
 import argparse
-import os
 import csv
-import json
+import io
+import os
 import pandas as pd
+import uuid
+import pyarrow as pa
+import pyarrow.compute as pa_compute
+import pyarrow.csv as pa_csv
 
 CSV_BASE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'csv')
+# number of rows converted to JSON at once when streaming data to BigQuery
+JSON_CHUNK_SIZE = 50000
+# size of blocks (in bytes) read at once from exported CSV files
+CSV_BLOCK_SIZE = 16 * 1024 * 1024
+# number of load jobs run concurrently
+UPLOAD_WORKERS = 8
+# number of times a load job is submitted when it fails for a transient reason
+LOAD_JOB_ATTEMPTS = 3
+# load job error reasons BigQuery documents as transient, other failures won't succeed with the same data
+TRANSIENT_LOAD_JOB_ERROR_REASONS = ('backendError', 'internalError', 'rateLimitExceeded')
+
+
+class LoadJobFailed(Exception):
+    """
+    Load job finished in a failed state, the job itself can't be retried, only submitted again under a new job id
+    """
+    def __init__(self, load_job):
+        super().__init__("Load job {} failed: {}".format(load_job.job_id, load_job.error_result))
+        self.load_job = load_job
+
+    @property
+    def transient(self):
+        return self.load_job.error_result.get('reason') in TRANSIENT_LOAD_JOB_ERROR_REASONS
+
+
+class JsonLinesStream(io.RawIOBase):
+    """
+    Read-only binary stream of newline delimited JSON, generated on the fly from an iterator of JSON lines strings,
+    so that data can be uploaded to BigQuery without being written to a temporary file first
+    """
+    def __init__(self, json_lines):
+        self.json_lines = json_lines
+        self.buffer = b''
+        self.offset = 0
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, b):
+        while self.offset == len(self.buffer):
+            json_lines = next(self.json_lines, None)
+            if json_lines is None:
+                return 0
+            self.buffer = json_lines.encode('utf8')
+            self.offset = 0
+
+        size = min(len(b), len(self.buffer) - self.offset)
+        b[:size] = memoryview(self.buffer)[self.offset:self.offset + size]
+        self.offset += size
+        self.position += size
+        return size
 
 
 class BigQueryUploader:
@@ -28,17 +90,62 @@ class BigQueryUploader:
         self.project_id = project_id
         self.dataset_id = dataset_id
         self.tmp_folder = tmp_folder
+        # table_id -> table, loaded lazily with a single list_tables call
+        self.tables = None
 
-    def __create_tmp_json(self, data_source, array_columns):
+    @staticmethod
+    def __data_chunks(data_source, array_columns=None):
         if isinstance(data_source, str):
-            return self.__create_tmp_json_from_csv(data_source, array_columns)
+            with open(data_source, 'r', newline='') as csv_file:
+                columns = next(csv.reader(csv_file, delimiter='|'), None)
+            if not columns:
+                return
+
+            # CSV is parsed by pyarrow's multithreaded reader block by block, all values are read as strings,
+            # empty values are kept as empty strings (same as in the CSV)
+            reader = pa_csv.open_csv(
+                data_source,
+                read_options=pa_csv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+                parse_options=pa_csv.ParseOptions(delimiter='|', newlines_in_values=True),
+                convert_options=pa_csv.ConvertOptions(column_types={column: pa.string() for column in columns}),
+            )
+            for batch in reader:
+                if array_columns:
+                    # array columns exported from PSQL are formated as {value1, value2, ...}
+                    # remove opening and closing brackets {} and make an array directly in arrow
+                    batch = pa.RecordBatch.from_arrays(
+                        [
+                            pa_compute.split_pattern(pa_compute.utf8_slice_codeunits(array, 1, -1), pattern=',')
+                            if name in array_columns else array
+                            for name, array in zip(batch.schema.names, batch.columns)
+                        ],
+                        names=batch.schema.names
+                    )
+                yield batch.to_pandas()
         elif isinstance(data_source, pd.DataFrame):
-            return self._create_tmp_json_from_pandas_dataframe(data_source, array_columns)
+            for start in range(0, len(data_source), JSON_CHUNK_SIZE):
+                yield data_source.iloc[start:start + JSON_CHUNK_SIZE].copy()
         else:
             raise TypeError(
                 f'Unsupported function signature for given data source reference of type {type(data_source)}'
             )
 
+    def __json_lines(self, data_source, array_columns=None):
+        for data in self.__data_chunks(data_source, array_columns):
+            if data.empty:
+                continue
+
+            # convert string array columns of dataframes to arrays, CSV array columns are already converted
+            if array_columns and isinstance(data_source, pd.DataFrame):
+                for col in array_columns:
+                    # remove opening and closing brackets {} and make an array, values that already are lists are kept
+                    is_string = data[col].apply(lambda content: isinstance(content, str))
+                    data[col] = data[col].where(~is_string, data[col].str.slice(1, -1).str.split(','))
+
+            # to_json rounds floats to 10 digits by default, 15 is the most it keeps
+            json_lines = data.to_json(orient='records', lines=True, date_format='iso', double_precision=15)
+            yield json_lines if json_lines.endswith('\n') else json_lines + '\n'
+
     def is_dataset_ready(self):
         try:
             self.client.get_dataset(self.dataset_id)
@@ -56,84 +163,72 @@ class BigQueryUploader:
     def __tid(self, table_id):
         return self.project_id + '.' + self.dataset_id + '.' + table_id
 
+    def __cached_tables(self):
+        if self.tables is None:
+            self.tables = {
+                table.table_id: table for table in self.client.list_tables(self.project_id + '.' + self.dataset_id)
+            }
+        return self.tables
+
     def table_exists(self, table_id):
-        try:
-            self.client.get_table(self.__tid(table_id))
-            return True
-        except NotFound:
-            return False
+        return table_id in self.__cached_tables()
 
     def get_table(self, table_id):
-        return self.client.get_table(self.__tid(table_id))
-
-    def __json_tmp_file(self):
-        return os.path.join(self.tmp_folder, "tmp.json")
-
-    def __create_tmp_json_from_csv(self, csv_path, array_columns=None):
-        tmpfile_path = self.__json_tmp_file()
-
-        with open(csv_path, 'r', newline='') as csvfile:
-            reader = csv.DictReader(csvfile, delimiter='|')
-            with open(tmpfile_path, 'w') as jsonfile:
-                for row in reader:
-                    # convert string array columns to arrays
-                    if array_columns:
-                        for col in array_columns:
-                            # array columns exported from PSQL are formated as {value1, value2, ...}
-                            content = row[col]
-                            # remove opening and closing brackets {}
-                            # make an array
-                            row[col] = content[1:-1].split(',')
-
-                    jsonfile.write(json.dumps(row) + "\n")
-        return tmpfile_path
-
-    def _create_tmp_json_from_pandas_dataframe(self, data, array_columns=None):
-        tmpfile_path = self.__json_tmp_file()
-
-        with open(tmpfile_path, 'w') as jsonfile:
-            for row in data.to_dict(orient='records'):
-                # convert string array columns to arrays
-                if array_columns:
-                    for col in array_columns:
-                        # array columns exported from PSQL are formated as {value1, value2, ...}
-                        content = row[col]
-                        # remove opening and closing brackets {}
-                        # make an array
-                        if not isinstance(row[col], list):
-                            row[col] = content[1:-1].split(',')
+        # cached tables come from list_tables and don't carry a schema, which load jobs don't need
+        tables = self.__cached_tables()
+        if table_id not in tables:
+            tables[table_id] = self.client.get_table(self.__tid(table_id))
+        return tables[table_id]
 
-                jsonfile.write(json.dumps(row) + "\n")
-        return tmpfile_path
+    def upload_csv_to_table(self, table_id, data_source, array_columns=None, job_id=None):
+        """
+        :param table_id:
+        :param data_source:
+        :param array_columns:
+        :param job_id: deterministic load job id, when the job already exists (e.g. a retry after a transient error
+        while the job was already created) the existing job is awaited instead of uploading the data again
+        :raises LoadJobFailed: when the load job finishes with an error, API errors while submitting or waiting for the
+        job are raised as they are
+        """
+        # Data are streamed as newline delimited JSON (CSV load doesn't support repeated fields)
+        json_lines = self.__json_lines(data_source=data_source, array_columns=array_columns)
+        first_json_lines = next(json_lines, None)
+        if first_json_lines is None:
+            print("CSV contains no data (after conversion), not uploading")
+            return
 
-    def upload_csv_to_table(self, table_id, data_source, array_columns=None):
-        # First, we need to convert our data to newline delimited JSON (CSV load doesn't support repeated fields)
-        json_path = self.__create_tmp_json(data_source=data_source, array_columns=array_columns)
+        def all_json_lines():
+            yield first_json_lines
+            yield from json_lines
 
-        try:
-            if os.path.getsize(json_path) == 0:
-                print("CSV contains no data (after conversion), not uploading")
-                return
-
-            table = self.get_table(table_id)
+        table = self.get_table(table_id)
 
-            job_config = bigquery.LoadJobConfig(source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON)
-            with open(json_path, "rb") as source_file:
+        job_config = bigquery.LoadJobConfig(source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON)
+        # streams shorter reads than requested are considered finished by the upload, hence the buffered reader
+        try:
+            with io.BufferedReader(JsonLinesStream(all_json_lines())) as source_file:
                 load_job = self.client.load_table_from_file(source_file, table,
-                                                            job_config=job_config)
+                                                            job_config=job_config, job_id=job_id)
+        except Conflict:
+            if job_id is None:
+                raise
+            print("Load job {} already exists, waiting for it instead of uploading again".format(job_id))
+            load_job = self.client.get_job(job_id)
 
+        try:
             load_job.result()  # Waits for the job to complete.
-            print(
-                "Uploaded CSV to table {}.{}.{}".format(table.project, table.dataset_id, table.table_id)
-            )
-        except BadRequest:
+        except GoogleAPICallError as e:
+            # without an error result the job state is unknown, e.g. polling failed, and it can be awaited again
+            if load_job.error_result is None:
+                raise
             print("Unable to upload file, errors:\n")
-            for err in load_job.errors:
+            for err in load_job.errors or [load_job.error_result]:
                 print(err['message'])
-            raise
-        finally:
-            if os.path.exists(json_path):
-                os.remove(json_path)
+            raise LoadJobFailed(load_job) from e
+
+        print(
+            "Uploaded CSV to table {}.{}.{}".format(table.project, table.dataset_id, table.table_id)
+        )
 
     def create_table(self, table_id, schema, time_partitioning=None):
         table = bigquery.Table(self.__tid(table_id), schema=schema)
@@ -142,6 +237,7 @@ class BigQueryUploader:
             table.time_partitioning = time_partitioning
 
         table = self.client.create_table(table)  # Make an API request.
+        self.__cached_tables()[table_id] = table
         print(
             "Created table {}.{}.{}".format(table.project, table.dataset_id, table.table_id)
         )
@@ -224,33 +320,50 @@ def run(file_date, csv_folder):
             expiration_ms=31536000000,  # 1 year
         ))
 
-    # Upload data
-    csv_path = os.path.join(csv_folder, "browsers_" + file_date + ".csv")
-    uploader.upload_csv_to_table(browsers, csv_path)
-    csv_path = os.path.join(csv_folder, "browser_users_" + file_date + ".csv")
-    uploader.upload_csv_to_table(browser_users, csv_path)
-
-    csv_path = os.path.join(csv_folder, "aggregated_browser_days_" + file_date + ".csv")
-    uploader.upload_csv_to_table(aggregated_browser_days, csv_path, ["user_ids"])
-    csv_path = os.path.join(csv_folder, "aggregated_browser_days_tags_" + file_date + ".csv")
-    uploader.upload_csv_to_table(aggregated_browser_days_tags, csv_path)
-    csv_path = os.path.join(csv_folder, "aggregated_browser_days_categories_" + file_date + ".csv")
-    uploader.upload_csv_to_table(aggregated_browser_days_categories, csv_path)
-    csv_path = os.path.join(csv_folder, "aggregated_browser_days_referer_mediums_" + file_date + ".csv")
-    uploader.upload_csv_to_table(aggregated_browser_days_referer_mediums, csv_path)
-
-    csv_path = os.path.join(csv_folder, "aggregated_user_days_" + file_date + ".csv")
-    uploader.upload_csv_to_table(aggregated_user_days, csv_path, ["browser_ids"])
-    csv_path = os.path.join(csv_folder, "aggregated_user_days_tags_" + file_date + ".csv")
-    uploader.upload_csv_to_table(aggregated_user_days_tags, csv_path)
-    csv_path = os.path.join(csv_folder, "aggregated_user_days_categories_" + file_date + ".csv")
-    uploader.upload_csv_to_table(aggregated_user_days_categories, csv_path)
-    csv_path = os.path.join(csv_folder, "aggregated_user_days_referer_mediums_" + file_date + ".csv")
-    uploader.upload_csv_to_table(aggregated_user_days_referer_mediums, csv_path)
-
-    csv_path = os.path.join(csv_folder, "events_" + file_date + ".csv")
-    uploader.upload_csv_to_table(events, csv_path)
+    # Upload data, load jobs are independent so they run concurrently, transient API errors are retried.
+    # Every load job gets a deterministic id within this run, so a retry never appends the same data twice.
+    # Jobs that failed are never awaited again, only transient failures are submitted again under a new id
+    tasks = [
+        (browsers, "browsers_", None),
+        (browser_users, "browser_users_", None),
+        (aggregated_browser_days, "aggregated_browser_days_", ["user_ids"]),
+        (aggregated_browser_days_tags, "aggregated_browser_days_tags_", None),
+        (aggregated_browser_days_categories, "aggregated_browser_days_categories_", None),
+        (aggregated_browser_days_referer_mediums, "aggregated_browser_days_referer_mediums_", None),
+        (aggregated_user_days, "aggregated_user_days_", ["browser_ids"]),
+        (aggregated_user_days_tags, "aggregated_user_days_tags_", None),
+        (aggregated_user_days_categories, "aggregated_user_days_categories_", None),
+        (aggregated_user_days_referer_mediums, "aggregated_user_days_referer_mediums_", None),
+        (events, "events_", None),
+    ]
+
+    # tables are looked up before the workers start, so the threads only ever read the cache
+    for table_id, _, _ in tasks:
+        uploader.get_table(table_id)
+
+    run_id = uuid.uuid4().hex
+    upload_with_retry = retry.Retry(
+        predicate=retry.if_exception_type(ServiceUnavailable, InternalServerError, TooManyRequests),
+        initial=1.0,
+        multiplier=2.0,
+        deadline=600.0,
+    )(uploader.upload_csv_to_table)
+
+    def upload(task):
+        table_id, csv_prefix, array_columns = task
+        csv_path = os.path.join(csv_folder, csv_prefix + file_date + ".csv")
+        for attempt in range(1, LOAD_JOB_ATTEMPTS + 1):
+            job_id = "upload_{}_{}_{}_{}".format(table_id, file_date, run_id, attempt)
+            try:
+                upload_with_retry(table_id, csv_path, array_columns, job_id=job_id)
+                return
+            except LoadJobFailed as e:
+                if not e.transient or attempt == LOAD_JOB_ATTEMPTS:
+                    raise
+                print("{}, submitting it again".format(e))
 
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        list(executor.map(upload, tasks))
 
 def main():
     parser = argparse.ArgumentParser(
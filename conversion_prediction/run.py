@@ -10,8 +10,10 @@ logging.config.dictConfig(LOGGING)
 logger.setLevel(logging.INFO)
 
 import argparse
+import inspect
 import json
 import os
+import pickle
 import re
 import pandas as pd
 import numpy as np
@@ -19,12 +21,13 @@ import sqlalchemy
 import joblib
 
 from datetime import datetime, timedelta
-from typing import List, Dict, Tuple
+from typing import List, Dict, Set, Tuple
 from dateutil.parser import parse
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import precision_recall_fscore_support
 from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import MinMaxScaler, LabelEncoder
+from sklearn.compose import ColumnTransformer
+from sklearn.preprocessing import MinMaxScaler, LabelEncoder, OneHotEncoder
 from sqlalchemy import func
 from google.oauth2 import service_account
 
@@ -32,10 +35,17 @@ from utils.config import LABELS, FeatureColumns, CURRENT_MODEL_VERSION, AGGREGAT
     MIN_TRAINING_DAYS
 from utils.enums import SplitType, NormalizedFeatureHandling, DataRetrievalMode
 from utils.enums import ArtifactRetentionMode, ArtifactRetentionCollection, ModelArtifacts
-from utils.db_utils import create_connection
-from utils.bigquery import get_feature_frame_via_sqlalchemy
+from utils.bigquery import get_feature_frame_via_sqlalchemy, GCLOUD_CREDENTIALS_PATH
 from utils.mysql import get_payment_history_features, get_global_context
-from utils.data_transformations import unique_list, row_wise_normalization
+from utils.data_transformations import unique_lists, row_wise_normalization
+
+# Forest pickles are dominated by repetitive tree arrays, lz4 shrinks them at close to disk speed
+MODEL_COMPRESSION = ('lz4', 3)
+PREDICTIONS_UPLOAD_CHUNK_SIZE = 500000
+PREDICTION_BATCH_SIZE = 200000
+MODEL_RELATED_FILE_PATTERN = re.compile(
+    r'^(category_lists|column_transformer|scaler|model|variable_importances)_(\d{4}-\d{2}-\d{2})\.(?:json|pkl|csv)$'
+)
 
 
 class ConversionPredictionModel(object):
@@ -69,31 +79,45 @@ class ConversionPredictionModel(object):
         self.le = LabelEncoder()
         self.outcome_labels = outcome_labels
         self.le.fit(outcome_labels)
-        self.X_train = pd.DataFrame()
-        self.X_test = pd.DataFrame()
-        self.Y_train = pd.Series()
-        self.Y_test = pd.Series()
+        self.X_train = None
+        self.X_test = None
+        self.Y_train = None
+        self.Y_test = None
         self.scaler = MinMaxScaler()
+        self.column_transformer = None
         self.model_date = None
         self.training_split_parameters = training_split_parameters
         self.undersampling_factor = undersampling_factor
         self.model = None
         self.outcome_frame = None
         self.scoring_date = datetime.utcnow()
-        self.prediction_data = pd.DataFrame()
-        self.predictions = pd.DataFrame()
+        self.prediction_data = None
+        self.predictions = None
         self.artifact_retention_mode = artifact_retention_mode
         self.artifacts_to_retain = [artifact.value for artifact in artifacts_to_retain.value]
         self.path_to_model_files = os.getenv('PATH_TO_MODEL_FILES', path_to_model_files)
         if not os.path.exists(self.path_to_model_files):
             os.mkdir(self.path_to_model_files)
         self.path_to_commerce_csvs = os.getenv('PATH_TO_COMMERCE_CSV_FILES')
-        self.negative_outcome_frame = pd.DataFrame()
-        self.browser_day_combinations_original_set = pd.DataFrame()
-        self.variable_importances = pd.Series()
+        self.negative_outcome_frame = None
+        self.browser_day_combinations_original_set = None
+        self.variable_importances = None
         self.dry_run = dry_run
+        self._bq_credentials = None
         self.prediction_job_log = None
 
+    @property
+    def bq_credentials(self) -> service_account.Credentials:
+        '''
+        Loads the GCP credentials on first use and reuses them for every upload afterwards
+        '''
+        if self._bq_credentials is None:
+            self._bq_credentials = service_account.Credentials.from_service_account_file(
+                GCLOUD_CREDENTIALS_PATH,
+            )
+
+        return self._bq_credentials
+
     def artifact_handler(self, artifact: ModelArtifacts):
         '''
         :param artifact:
@@ -112,13 +136,14 @@ class ConversionPredictionModel(object):
         '''
         if self.artifact_retention_mode == ArtifactRetentionMode.DUMP:
             if artifact == ModelArtifacts.MODEL:
-                joblib.dump(
-                    self.model,
-                    f'{self.path_to_model_files}model_{self.model_date}.pkl'
-                )
+                self.dump_model()
             else:
-                getattr(self, artifact.value, pd.DataFrame())\
-                    .to_csv(f'{self.path_to_model_files}artifact_{artifact.value}_{self.min_date}_{self.max_date}.csv')
+                artifact_data = getattr(self, artifact.value, None)
+                if artifact_data is None:
+                    artifact_data = pd.DataFrame()
+                artifact_data.to_csv(
+                    f'{self.path_to_model_files}artifact_{artifact.value}_{self.min_date}_{self.max_date}.csv'
+                )
                 logger.info(f'  * {artifact.value} artifact dumped to {self.path_to_model_files}')
         delattr(self, artifact.value)
         logger.info(f'  * {artifact.value} artifact dropped')
@@ -149,24 +174,31 @@ class ConversionPredictionModel(object):
         )
 
         logger.info(f'  * Query finished, processing retrieved data')
-
-        for column in [column for column in self.feature_columns.return_feature_list()
-                       if column not in self.user_profiles.columns
-                       and column not in [
-                              'clv', 'days_since_last_subscription', 'article_pageviews_count',
-                              'sum_paid', 'avg_price'] +
-                       [  # Iterate over all aggregation function types
-                              f'pageviews_{aggregation_function_alias}'
-                              for aggregation_function_alias in self.feature_aggregation_functions.keys()
-                       ]
-                       ]:
-            self.user_profiles[column] = 0.0
+        # browser_id is the key of most of the groupbys and merges below, integer codes make those cheaper
+        self.user_profiles['browser_id'] = self.user_profiles['browser_id'].astype('category')
+
+        self.fill_columns_with_zeros(
+            [column for column in self.feature_columns.return_feature_list()
+             if column not in self.user_profiles.columns
+             and column not in [
+                    'clv', 'days_since_last_subscription', 'article_pageviews_count',
+                    'sum_paid', 'avg_price'] +
+             [  # Iterate over all aggregation function types
+                    f'pageviews_{aggregation_function_alias}'
+                    for aggregation_function_alias in self.feature_aggregation_functions.keys()
+             ]
+             ]
+        )
         logger.info(f'  * Retrieved initial user profiles frame from DB')
+        self.user_profiles['date'] = pd.to_datetime(self.user_profiles['date']).dt.date
 
         try:
             self.get_contextual_features_from_mysql()
             self.feature_columns.add_global_context_features()
             logger.info('Successfully added global context features from mysql')
+        except pd.errors.MergeError:
+            # Duplicated merge keys point to a data problem, zero filled features would only hide it
+            raise
         except Exception as e:
             logger.info(
                 f'''Failed adding global context features from mysql with exception:
@@ -174,8 +206,7 @@ class ConversionPredictionModel(object):
                 proceeding with remaining features''')
             # To make sure these columns are filled in case of failure to retrieve
             # We want them appearing in the same order to avoid having to reorder columns
-            for column in ['article_pageviews_count', 'sum_paid', 'pageviews_count', 'avg_price']:
-                self.user_profiles[column] = 0.0
+            self.fill_columns_with_zeros(['article_pageviews_count', 'sum_paid', 'pageviews_count', 'avg_price'])
 
         # try:
         #     self.get_payment_window_features_from_csvs()
@@ -190,22 +221,22 @@ class ConversionPredictionModel(object):
         #     for column in ['checkout', 'payment', 'purchase']:
         #         self.user_profiles[column] = 0.0
 
-        self.user_profiles['date'] = pd.to_datetime(self.user_profiles['date']).dt.date
-
         try:
             self.get_user_history_features_from_mysql()
             self.feature_columns.add_payment_history_features()
             logger.info('Successfully added user payment history features from mysql')
+        except pd.errors.MergeError:
+            # Duplicated merge keys point to a data problem, zero filled features would only hide it
+            raise
         except Exception as e:
             logger.info(
                 f'''Failed adding payment history features from mysql with exception:
                 {e};
                 proceeding with remaining features''')
-            for column in ['clv', 'days_since_last_subscription']:
-                self.user_profiles[column] = 0.0
+            self.fill_columns_with_zeros(['clv', 'days_since_last_subscription'])
 
         self.user_profiles[self.feature_columns.numeric_columns_with_window_variants].fillna(0.0, inplace=True)
-        self.user_profiles['user_ids'] = self.user_profiles['user_ids'].apply(unique_list)
+        self.user_profiles['user_ids'] = unique_lists(self.user_profiles['user_ids'])
         logger.info('  * Initial data validation success')
 
     def get_payment_window_features_from_csvs(self):
@@ -216,67 +247,67 @@ class ConversionPredictionModel(object):
         Loads in csvs (location needs to be in .env), counts the number of events per browser_id and joins these counts
         to the main feature frame
         '''
-        commerce = pd.DataFrame()
         # TODO: remove commented out code in case testing the line below is a success
         dates = [date.date()
                  for date in pd.date_range(self.user_profiles['date'].min() - timedelta(days=7), self.max_date.date())]
         dates = [re.sub('-', '', str(date)) for date in dates]
-        for date in dates:
-            commerce_daily = pd.read_csv(f'{self.path_to_commerce_csvs}commerce_{date}.csv.gz')
-            commerce = commerce.append(
-                    commerce_daily,
-                    sort=False
-                    )
+        browser_ids = set(self.user_profiles['browser_id'].unique())
 
-        commerce = commerce[commerce['browser_id'].isin(self.user_profiles['browser_id'].unique())]
+        def read_commerce_daily(date):
+            commerce_daily = pd.read_csv(
+                f'{self.path_to_commerce_csvs}commerce_{date}.csv.gz',
+                usecols=['browser_id', 'time', 'step']
+            )
+            return commerce_daily[commerce_daily['browser_id'].isin(browser_ids)]
+
+        # Decompression and parsing release the GIL, so the daily files are read on a thread pool
+        commerce_daily_frames = joblib.Parallel(n_jobs=os.cpu_count(), backend='threading')(
+            joblib.delayed(read_commerce_daily)(date) for date in dates
+        )
+        commerce = pd.concat(commerce_daily_frames, ignore_index=True, copy=False, sort=False)
         commerce['date'] = pd.to_datetime(commerce['time']).dt.date
 
         commerce['dummy_column'] = 1.0
-        commerce_features = commerce[['date', 'step', 'dummy_column', 'browser_id']].groupby(
-            ['date', 'step', 'browser_id']).sum().reset_index()
-        commerce_features.head()
-
-        commerce_pivoted = pd.DataFrame()
 
         # We are using all the commerce steps based on the assumption that all of our postgres data is filtered for only
         # days before conversion, we will do a left join on the postgres data assuming this removes look-ahead
-        for step in commerce['step'].unique():
-            if commerce_pivoted.empty:
-                commerce_pivoted = commerce_features[commerce_features['step'] == step].rename(
-                    columns={'dummy_column': step})
-            else:
-                commerce_pivoted = commerce_pivoted.merge(
-                    right=commerce_features[commerce_features['step'] == step].rename(columns={'dummy_column': step}),
-                    on=['browser_id', 'date'],
-                    how='outer'
-                )
-            commerce_pivoted.drop('step', axis=1, inplace=True)
-
-        commerce_pivoted.index = commerce_pivoted['date']
-        commerce_pivoted.drop('date', axis=1, inplace=True)
-        commerce_pivoted.index = pd.to_datetime(commerce_pivoted.index)
-
+        commerce_pivoted = commerce.pivot_table(
+            index=['browser_id', 'date'],
+            columns='step',
+            values='dummy_column',
+            aggfunc='sum',
+            fill_value=0.0
+        ).reset_index()
+        commerce_pivoted.columns.name = None
+
+        commerce_pivoted['date'] = pd.to_datetime(commerce_pivoted['date'])
         commerce_pivoted.fillna(0.0, inplace=True)
         dates = self.user_profiles['date'].unique()
-        dates = [date.date() for date in pd.date_range(dates.min() - timedelta(days=7), dates.max())]
-        rolling_commerce_pivotted = (commerce_pivoted.groupby(['browser_id'])
-                                     .apply(lambda x: x.reindex(dates)  # fill in the missing dates for each group)
-                                            .fillna(0.0)  # fill each missing group with 0
-                                            .rolling(7, min_periods=1)
-                                            .sum()))  # do a rolling sum
-
+        dates = pd.date_range(dates.min() - timedelta(days=7), dates.max())
+        # Rolling sums are computed for all browsers at once on a date x browser_id grid
+        # with the missing dates filled in with 0
+        rolling_commerce_pivotted = (commerce_pivoted.set_index(['date', 'browser_id'])
+                                     .unstack('browser_id', fill_value=0.0)
+                                     .reindex(dates, fill_value=0.0)
+                                     .rolling(7, min_periods=1)
+                                     .sum()
+                                     .stack('browser_id'))
+
+        rolling_commerce_pivotted.index.names = ['date', 'browser_id']
         rolling_commerce_pivotted.reset_index(inplace=True)
+        rolling_commerce_pivotted['date'] = rolling_commerce_pivotted['date'].dt.date
 
         rolling_commerce_pivotted = rolling_commerce_pivotted[
             (rolling_commerce_pivotted['date'] >= self.min_date.date()) &
             (rolling_commerce_pivotted['date'] <= self.max_date.date())
             ]
-        rolling_commerce_pivotted['date'] = pd.to_datetime(rolling_commerce_pivotted['date']).dt.date
 
         self.user_profiles = self.user_profiles.merge(
             right=rolling_commerce_pivotted,
             on=['browser_id', 'date'],
             how='left',
+            validate='m:1',
+            sort=False,
             copy=False
         )
         # TODO: Come up with a better handling for these features for past positives (currently no handling)
@@ -293,9 +324,11 @@ class ConversionPredictionModel(object):
         payment_history_features = get_payment_history_features(self.max_date)
 
         # We'll only be matching the first user_id in the list for speed reasons
-        self.user_profiles['first_user_id'] = self.user_profiles['user_ids'].apply(
-            lambda x: x[0]
-        ).str.extract('([0-9]+)')
+        first_user_ids = pd.Series(
+            [user_ids[0] if len(user_ids) else '' for user_ids in self.user_profiles['user_ids'].values],
+            index=self.user_profiles.index
+        )
+        self.user_profiles['first_user_id'] = first_user_ids.str.extract('([0-9]+)', expand=False)
         # TODO: Come up with a better handling for these features for past positives (currently no handling)
         # for index, row in payment_history_features.iterrows():
         #     if index % int(len(payment_history_features) / 10) == 0:
@@ -317,25 +350,30 @@ class ConversionPredictionModel(object):
             right=payment_history_features,
             left_on='first_user_id',
             right_on='user_id',
-            how='left'
+            how='left',
+            validate='m:1',
+            sort=False,
+            copy=False
         )
 
-        self.user_profiles['clv'] = self.user_profiles['clv'].astype(float)
-        self.user_profiles['clv'].fillna(0.0, inplace=True)
         # In case the user had additional subscriptions that have an end date after the date of the user profile,
         # we treat it as a missing value.
         # TODO: Add better treatment for look-ahead removal
-        self.user_profiles['last_subscription_end'] = pd.to_datetime(self.user_profiles['last_subscription_end']).dt.date 
-        self.user_profiles.loc[
-            self.user_profiles['last_subscription_end'] >= self.user_profiles['date'],
-            'clv'
-        ] = 0.0
+        look_ahead = (
+            pd.to_datetime(self.user_profiles['last_subscription_end']).dt.normalize().values >=
+            pd.to_datetime(self.user_profiles['date']).values
+        )
+        self.user_profiles['clv'] = np.where(
+            look_ahead,
+            0.0,
+            np.nan_to_num(self.user_profiles['clv'].to_numpy(dtype=np.float32))
+        ).astype(np.float32)
         # The 1000 days is an arbitrary choice here
-        self.user_profiles['days_since_last_subscription'].fillna(1000.0, inplace=True)
-        self.user_profiles.loc[
-            self.user_profiles['last_subscription_end'] >= self.user_profiles['date'],
-            'days_since_last_subscription'
-        ] = 1000.0
+        self.user_profiles['days_since_last_subscription'] = np.where(
+            look_ahead,
+            1000.0,
+            self.user_profiles['days_since_last_subscription'].fillna(1000.0).to_numpy(dtype=np.float32)
+        ).astype(np.float32)
 
         self.user_profiles.drop(['last_subscription_end', 'first_user_id'], axis=1, inplace=True)
 
@@ -353,30 +391,19 @@ class ConversionPredictionModel(object):
             self.user_profiles['date'].max()
         )
         
-        context.index = context['date']
-        context.drop('date', axis=1, inplace=True)
-        context.index = pd.to_datetime(context.index)
-        rolling_context = (context.groupby('date')
-                           .fillna(0)  # fill each missing group with 0
-                           .rolling(7, min_periods=1)
-                           .sum())  # do a rolling sum
-        rolling_context.reset_index(inplace=True)
-        rolling_context['avg_price'] = rolling_context['sum_paid'] / rolling_context['payment_count']
+        # Rolling sums and average price are already computed in the db
+        rolling_context = context
         rolling_context['date'] = pd.to_datetime(rolling_context['date']).dt.date
-        # create str variant of the date columns since we can't join on date in pandas
-        rolling_context['date_str'] = rolling_context['date'].astype(str)
-        self.user_profiles['date_str'] = self.user_profiles['date'].astype(str)
 
         self.user_profiles = self.user_profiles.merge(
             right=rolling_context,
-            on='date_str',
+            on='date',
             how='left',
+            validate='m:1',
+            sort=False,
             copy=False
         )
 
-        self.user_profiles.drop(['date_str', 'date_y'], axis=1, inplace=True)
-        self.user_profiles.rename(columns={'date_x': 'date'}, inplace=True)
-
     def introduce_row_wise_normalized_features(self):
         '''
         Requires:
@@ -389,27 +416,36 @@ class ConversionPredictionModel(object):
         self.add_missing_json_columns()
         column_sets = list(self.feature_columns.profile_numeric_columns_from_json_fields.values()) + \
             [time_column_variant for time_column_variant in self.feature_columns.time_based_columns.values()]
+        if self.normalization_handling not in (NormalizedFeatureHandling.REPLACE_WITH, NormalizedFeatureHandling.ADD):
+            raise ValueError('Unknown normalization handling parameter')
+
+        # In ADD mode all of the normalized sets are written into slices of one buffer, which is appended at once
+        normalized_columns = [column for column_set in column_sets for column in column_set]
+        normalized_data = np.empty((len(self.user_profiles), len(normalized_columns)), dtype=np.float32)
+        offset = 0
         for column_set in column_sets:
-            self.user_profiles[column_set] = self.user_profiles[column_set].astype(float)
-            normalized_data = pd.DataFrame(row_wise_normalization(np.array(self.user_profiles[column_set])))
-            normalized_data.fillna(0.0, inplace=True)
-            normalized_data.columns = column_set
+            normalized_slice = normalized_data[:, offset:offset + len(column_set)]
+            offset += len(column_set)
+            row_wise_normalization(
+                self.user_profiles[column_set].to_numpy(dtype=np.float64),
+                normalized_slice
+            )
 
             if self.normalization_handling is NormalizedFeatureHandling.REPLACE_WITH:
-                self.user_profiles.drop(column_set, axis=1, inplace=True)
-            elif self.normalization_handling is NormalizedFeatureHandling.ADD:
+                self.user_profiles[column_set] = normalized_slice
+            else:
                 self.feature_columns.add_normalized_profile_features_version(
                     list(self.feature_aggregation_functions.keys())
                 )
-            else:
-                raise ValueError('Unknown normalization handling parameter')
 
+        if self.normalization_handling is NormalizedFeatureHandling.ADD:
             self.user_profiles = pd.concat(
                 [
                     self.user_profiles,
-                    normalized_data
+                    pd.DataFrame(normalized_data, columns=normalized_columns, index=self.user_profiles.index)
                 ],
-                axis=1
+                axis=1,
+                copy=False
             )
         logger.info('  * Feature normalization success')
 
@@ -429,8 +465,34 @@ class ConversionPredictionModel(object):
             for column in column_list
         ]
 
-        for missing_json_column in set(potential_columns) - set(self.user_profiles.columns):
-            self.user_profiles[missing_json_column] = 0.0
+        self.fill_columns_with_zeros(list(set(potential_columns) - set(self.user_profiles.columns)))
+
+    def fill_columns_with_zeros(self, columns: List[str]):
+        '''
+        Requires:
+            - user_profiles
+        Sets the given columns to 0.0, the ones that don't exist yet are appended as a single float32 block instead of
+        being inserted one by one, since every single insert copies the whole frame
+        :param columns:
+        :return:
+        '''
+        existing_columns = [column for column in columns if column in self.user_profiles.columns]
+        new_columns = [column for column in dict.fromkeys(columns) if column not in self.user_profiles.columns]
+        if existing_columns:
+            self.user_profiles[existing_columns] = 0.0
+        if new_columns:
+            self.user_profiles = pd.concat(
+                [
+                    self.user_profiles,
+                    pd.DataFrame(
+                        np.zeros((len(self.user_profiles), len(new_columns)), dtype=np.float32),
+                        columns=new_columns,
+                        index=self.user_profiles.index
+                    )
+                ],
+                axis=1,
+                copy=False
+            )
 
     def create_feature_frame(
             self,
@@ -450,13 +512,10 @@ class ConversionPredictionModel(object):
         logger.info(f'  * Loading user profiles')
         self.get_user_profiles_by_date(data_retrieval_mode)
         logger.info(f'  * Processing user profiles')
-        test_outcome = self.user_profiles['outcome'].fillna(
-            self.user_profiles.groupby('browser_id')['outcome'].fillna(method='bfill')
-        )
-        test_outcome = test_outcome.fillna(
-            self.user_profiles.groupby('browser_id')['outcome'].fillna(method='ffill')
-        )
-        self.user_profiles['outcome'] = test_outcome
+        # Sorting once lets both fills run over the groups without re-sorting them
+        self.user_profiles.sort_values(['browser_id', 'date'], inplace=True)
+        outcome_by_browser = self.user_profiles.groupby('browser_id', sort=False, observed=True)['outcome']
+        self.user_profiles['outcome'] = outcome_by_browser.bfill().combine_first(outcome_by_browser.ffill())
         self.encode_uncommon_categories()
         self.transform_bool_columns_to_int()
         logger.info('  * Filtering user profiles')
@@ -472,8 +531,8 @@ class ConversionPredictionModel(object):
             - user_profiles
         Transform True / False columns into 0/1 columns
         '''
-        for column in [column for column in self.feature_columns.bool_columns]:
-            self.user_profiles[column] = self.user_profiles[column].apply(lambda value: True if value == 't' else False).astype(int)
+        bool_columns = list(self.feature_columns.bool_columns)
+        self.user_profiles[bool_columns] = (self.user_profiles[bool_columns].to_numpy() == 't').astype(np.int8)
 
     def encode_uncommon_categories(self):
         '''
@@ -483,10 +542,8 @@ class ConversionPredictionModel(object):
         '''
         self.user_profiles.loc[self.user_profiles['device'] == 0, 'device'] = 'Desktop'
         for column in self.feature_columns.categorical_columns:
-            column_values_to_recode = list(
-                self.user_profiles[column
-                ].value_counts(normalize=True)[self.user_profiles[column].value_counts(normalize=True) < 0.05].index)
-            self.user_profiles.loc[self.user_profiles[column].isin(column_values_to_recode), column] = 'Other'
+            frequencies = self.user_profiles[column].map(self.user_profiles[column].value_counts(normalize=True))
+            self.user_profiles.loc[frequencies < 0.05, column] = 'Other'
 
     def generate_category_list_dict(self) -> Dict:
         '''
@@ -498,54 +555,81 @@ class ConversionPredictionModel(object):
         for column in self.feature_columns.categorical_columns:
             self.category_list_dict[column] = list(self.user_profiles[column].unique()) + ['Unknown']
 
-    def encode_unknown_categorie(self, data: pd.Series):
+    def create_column_transformer(self) -> ColumnTransformer:
         '''
-        In train and predictiom set, we mighr encounter categorie that weren't present in the test set, in order
-        to allow for the prediction algorithm to handle these, we create an Unknown category
-        :param data:
-        :return:
+        Requires:
+            - user_profiles
+            - feature_columns
+            - category_list_dict
+            - scaler
+        Creates the transformer fusing scaling of numeric variables, dummification of categorical ones and selection
+        of the remaining features into a single pass. Categories that weren't present in the train set get all 0 dummy
+        columns, which is the same as the dropped Unknown column used to encode them
         '''
-        data[~(data.isin(self.category_list_dict[data.name]))] = 'Unknown'
-
-        return data
+        categorical_columns = list(self.feature_columns.categorical_columns)
+        excluded_columns = self.feature_columns.return_scaled_config_and_bool_columns() | \
+            set(categorical_columns) | {'outcome', 'user_ids'}
+
+        return ColumnTransformer(
+            [
+                ('numeric', self.scaler, self.feature_columns.numeric_columns_with_window_variants),
+                ('categorical', OneHotEncoder(
+                    # Categories are compared as strings, sklearn requires sorted lists for numeric categories
+                    categories=[
+                        list(dict.fromkeys(
+                            str(category) for category in self.category_list_dict[column] if category != 'Unknown'
+                        ))
+                        for column in categorical_columns
+                    ],
+                    handle_unknown='ignore',
+                    sparse=False,
+                    dtype=np.float32
+                ), categorical_columns),
+                ('remaining', 'passthrough',
+                 [column for column in self.user_profiles.columns if column not in excluded_columns])
+            ],
+            sparse_threshold=0
+        )
 
-    def generate_dummy_columns_from_categorical_column(self, data: pd.Series) -> pd.DataFrame:
+    def column_transformer_input(self, data: pd.DataFrame) -> pd.DataFrame:
         '''
         Requires:
-            - category_lists_dict
-        Generate 0/1 columns from categorical columns handling the logic for Others and Unknown categorie. Always drops
-        the Unknown columns (since we only need k-1 columns for k categorie)
-        :param data: A column to encode
+            - column_transformer
+        Selects the columns the column transformer was created with, columns missing in the data are filled with 0
+        :param data:
         :return:
         '''
-        data = self.encode_unknown_categorie(data)
-        dummies = pd.get_dummies(pd.Categorical(data, categories=self.category_list_dict[data.name]))
-        dummies.columns = [data.name + '_' + dummy_column for dummy_column in dummies.columns]
-        dummies.drop(columns=data.name + '_Unknown', axis=1, inplace=True)
-        dummies.index = data.index
+        columns = [
+            column for _, _, transformer_columns in self.column_transformer.transformers
+            for column in transformer_columns
+        ]
+        data = data.reindex(columns=columns, fill_value=0.0)
+        categorical_columns = [
+            column for name, _, transformer_columns in self.column_transformer.transformers
+            if name == 'categorical' for column in transformer_columns
+        ]
+        data[categorical_columns] = data[categorical_columns].astype(str)
 
-        return dummies
+        return data
 
-    def replace_dummy_columns_with_dummies(self, data: pd.DataFrame) -> pd.DataFrame:
+    def column_transformer_feature_names(self) -> List[str]:
         '''
         Requires:
-            - category_lists_dict
-        Generates new dummy columns and drops the original categorical ones
-        :param data:
-        :param category_lists_dict:
-        :return:
+            - column_transformer
+        Names the columns of the column transformer output, dummies are named {column}_{category}
         '''
-        for column in self.feature_columns.categorical_columns:
-            data = pd.concat(
-                [
-                    data,
-                    self.generate_dummy_columns_from_categorical_column(
-                        data[column])
-                ],
-                axis=1)
-        data.drop(columns=self.feature_columns.categorical_columns, axis=1, inplace=True)
-
-        return data
+        feature_names = []
+        for name, transformer, columns in self.column_transformer.transformers_:
+            if name == 'categorical':
+                feature_names.extend([
+                    f'{column}_{category}'
+                    for column, categories in zip(columns, transformer.categories_)
+                    for category in categories
+                ])
+            elif name != 'remainder':
+                feature_names.extend(columns)
+
+        return feature_names
 
     def create_train_test_transformations(self):
         '''
@@ -579,55 +663,46 @@ class ConversionPredictionModel(object):
             train_indices = self.user_profiles[self.user_profiles['date'] <= train_date.date()].index
             test_indices = self.user_profiles[self.user_profiles['date'] > train_date.date()].index
 
-        self.X_train = self.user_profiles.iloc[train_indices].drop(columns=['outcome', 'user_ids'])
-        self.X_test = self.user_profiles.iloc[test_indices].drop(columns=['outcome', 'user_ids'])
+        # Sorting the indices once keeps all of the frames below aligned without any further sort_index calls
+        train_indices = train_indices.sort_values()
+        test_indices = test_indices.sort_values()
+
         self.generate_category_list_dict()
 
         with open(
                 f'{self.path_to_model_files}category_lists_{self.model_date}.json', 'w') as outfile:
             json.dump(self.category_list_dict, outfile)
 
-        self.X_train = self.replace_dummy_columns_with_dummies(self.X_train)
-        self.X_test = self.replace_dummy_columns_with_dummies(self.X_test)
+        self.Y_train = self.user_profiles.loc[train_indices, 'outcome']
+        self.Y_test = self.user_profiles.loc[test_indices, 'outcome']
 
-        self.Y_train = self.user_profiles.loc[train_indices, 'outcome'].sort_index()
-        self.Y_test = self.user_profiles.loc[test_indices, 'outcome'].sort_index()
+        self.column_transformer = self.create_column_transformer()
+        numeric_columns = self.feature_columns.numeric_columns_with_window_variants
+        X_train_input = self.column_transformer_input(self.user_profiles.loc[train_indices])
+        X_train_input[numeric_columns] = X_train_input[numeric_columns].fillna(0)
+        X_test_input = self.column_transformer_input(self.user_profiles.loc[test_indices])
+        X_test_input[numeric_columns] = X_test_input[numeric_columns].fillna(0)
 
-        logger.info('  * Dummy variables generation success')
+        # Scaling, dummies and the remaining features come out of the transformer as a single float32 block
+        X_train_features = np.ascontiguousarray(
+            self.column_transformer.fit_transform(X_train_input), dtype=np.float32
+        )
+        X_test_features = np.ascontiguousarray(
+            self.column_transformer.transform(X_test_input), dtype=np.float32
+        )
+        del (X_train_input, X_test_input)
+        self.scaler = self.column_transformer.named_transformers_['numeric']
 
-        X_train_numeric = self.user_profiles.loc[
-            train_indices,
-            self.feature_columns.numeric_columns_with_window_variants
-        ].fillna(0)
-        X_test_numeric = self.user_profiles.loc[
-            test_indices,
-            self.feature_columns.numeric_columns_with_window_variants
-        ].fillna(0)
-
-        X_train_numeric = pd.DataFrame(self.scaler.fit_transform(X_train_numeric), index=train_indices,
-                                       columns=self.feature_columns.numeric_columns_with_window_variants).sort_index()
-
-        X_test_numeric = pd.DataFrame(self.scaler.transform(X_test_numeric), index=test_indices,
-                                      columns=self.feature_columns.numeric_columns_with_window_variants).sort_index()
-
-        logger.info('  * Numeric variables handling success')
-
-        self.X_train = pd.concat([X_train_numeric.sort_index(), self.X_train[
-            [column for column in self.X_train.columns
-             if column not in self.feature_columns.numeric_columns_with_window_variants +
-             self.feature_columns.config_columns +
-             self.feature_columns.bool_columns]
-        ].sort_index()], axis=1)
-        self.X_test = pd.concat([X_test_numeric.sort_index(), self.X_test[
-            [column for column in self.X_train.columns
-             if column not in self.feature_columns.numeric_columns_with_window_variants +
-             self.feature_columns.config_columns +
-             self.feature_columns.bool_columns]
-        ].sort_index()], axis=1)
+        feature_names = self.column_transformer_feature_names()
+        self.X_train = pd.DataFrame(X_train_features, index=train_indices, columns=feature_names)
+        self.X_test = pd.DataFrame(X_test_features, index=test_indices, columns=feature_names)
+
+        logger.info('  * Numeric and dummy variables handling success')
 
         joblib.dump(
-            self.scaler,
-            f'{self.path_to_model_files}scaler_{self.model_date}.pkl'
+            self.column_transformer,
+            f'{self.path_to_model_files}column_transformer_{self.model_date}.pkl',
+            protocol=pickle.HIGHEST_PROTOCOL
         )
 
         # This is used later on for excluding negatives that we already evaluated
@@ -642,22 +717,27 @@ class ConversionPredictionModel(object):
         if ModelArtifacts.USER_PROFILES.value not in self.artifacts_to_retain:
             self.artifact_handler(ModelArtifacts.USER_PROFILES)
 
-    def delete_existing_model_file_for_same_date(self, filename: str) -> datetime.date:
+    def delete_existing_model_file_for_same_date(self, filename: str, existing_files: Set[str] = None):
         '''
         Requires:
             - model_date
             - path_to_model_files
         Deletes model files should they already exist for the given date
+        :param filename:
+        :param existing_files: contents of path_to_model_files, can be passed in to list the directory only once when
+        deleting multiple files
         '''
         if filename != 'category_lists':
             suffix = 'pkl'
         else:
             suffix = 'json'
 
-        if self.path_to_model_files in os.listdir(None):
-            if f'scaler_{self.model_date}.pkl' in os.listdir(
-                    None if self.path_to_model_files == '' else self.path_to_model_files):
-                os.remove(f'{self.path_to_model_files}{filename}_{self.model_date}.{suffix}')
+        if existing_files is None:
+            existing_files = set(os.listdir(self.path_to_model_files or '.'))
+
+        model_file = f'{filename}_{self.model_date}.{suffix}'
+        if model_file in existing_files:
+            os.remove(f'{self.path_to_model_files}{model_file}')
 
     def train_model(
             self,
@@ -673,8 +753,9 @@ class ConversionPredictionModel(object):
             - artifact_retention_mode
         Trains a new model given a full dataset
         '''
-        if 0 not in self.user_profiles['outcome'].unique():
-            self.user_profiles['outcome'] = self.le.transform(self.user_profiles['outcome'])
+        # Labels are only encoded once, an already encoded outcome column is numeric
+        if not pd.api.types.is_numeric_dtype(self.user_profiles['outcome']):
+            self.user_profiles['outcome'] = self.le.transform(self.user_profiles['outcome'].values)
 
         self.create_train_test_transformations()
         self.X_train.fillna(0.0, inplace=True)
@@ -682,8 +763,12 @@ class ConversionPredictionModel(object):
 
         logger.info('  * Commencing model training')
 
+        # Tree ensembles work on row-major float32 data, passing it in that layout saves sklearn a converted copy
+        X_train_array = np.ascontiguousarray(self.X_train.to_numpy(dtype=np.float32))
+        X_test_array = np.ascontiguousarray(self.X_test.to_numpy(dtype=np.float32))
+
         classifier_instance = model_function(**model_arguments)
-        self.model = classifier_instance.fit(self.X_train, self.Y_train)
+        self.model = classifier_instance.fit(X_train_array, self.Y_train)
 
         logger.info('  * Model training complete, generating outcome frame')
 
@@ -693,23 +778,40 @@ class ConversionPredictionModel(object):
                 'test': self.Y_test
             },
             {
-                'train': self.model.predict(self.X_train),
-                'test': self.model.predict(self.X_test)
+                'train': self.predict_labels(X_train_array),
+                'test': self.predict_labels(X_test_array)
             },
             self.outcome_labels,
             self.le
         )
-        try:
+        if hasattr(self.model, 'feature_importances_'):
             self.variable_importances = pd.Series(
                 data=self.model.feature_importances_,
                 index=self.X_train.columns
             )
-        except:
+        else:
             # This handles parameter tuning, when some model types may not have variable importance
-            self.variable_importances = pd.Series()
+            self.variable_importances = pd.Series(dtype=float)
 
         logger.info('  * Outcome frame generated')
 
+    def predict_labels(self, data: np.array) -> np.array:
+        '''
+        Requires:
+            - model
+        Predicts labels via predict_proba where the model supports it, since the probabilities are what forest models
+        compute their prediction from anyway, and they can be reused by the caller
+        :param data:
+        :return:
+        '''
+        if hasattr(self.model, 'predict_proba'):
+            return self.labels_from_probabilities(self.model.predict_proba(data))
+
+        return self.model.predict(data)
+
+    def labels_from_probabilities(self, probabilities: np.array) -> np.array:
+        return self.model.classes_[probabilities.argmax(axis=1)]
+
     @staticmethod
     def create_outcome_frame(
             labels_actual: Dict[str, np.array],
@@ -733,56 +835,30 @@ class ConversionPredictionModel(object):
             :param sets_in_outcome
             :return:
             '''
-            train_outcome_columns = (
-                [str(label) + '_train' for label in outcome_frame.columns[0:len(label_range)]]
-                if 'train' in sets_in_outcome
-                else []
-            )
-
-            test_outcome_columns = (
-                [
-                    str(label) + '_test' for label in outcome_frame.columns[
-                                                      # We either have 6 columns (3 for train and 3 for test) or 3 (test only), therefore we need to adjust indexing
-                                                      len(label_range) * (len(sets_in_outcome) - 1):(
-                                                                  len(sets_in_outcome) * len(label_range))]
-                ]
-                if 'test' in sets_in_outcome
-                else []
-            )
-
-            outcome_frame.columns = train_outcome_columns + test_outcome_columns
-
-            for i in label_range:
-                outcome_frame.columns = [re.sub(str(i), label_encoder.inverse_transform([i])[0], column)
-                                         for column in outcome_frame.columns]
+            # The partial frames are concatenated train first, each holding one column per encoded label
+            label_names = label_encoder.inverse_transform(label_range)
+            outcome_frame.columns = [
+                f'{label_name}_{outcome_set}'
+                for outcome_set in ['train', 'test'] if outcome_set in sets_in_outcome
+                for label_name in label_names
+            ]
 
             outcome_frame.index = ['precision', 'recall', 'f-score', 'support']
 
         label_range = list(range(0, len(outcome_labels)))
-        outcome_frame = pd.DataFrame()
-        for i in range(0, len(labels_actual)):
-            actual = list(labels_actual.values())[i]
-            predicted = list(labels_predicted.values())[i]
-            outcome_frame_partial = pd.DataFrame(
+        outcome_frame_partials = [
+            pd.DataFrame(
                 list(
                     precision_recall_fscore_support(
-                        actual,
-                        predicted,
+                        labels_actual[outcome_set],
+                        labels_predicted[outcome_set],
                         labels=label_range
                     )
                 )
             )
-
-            if outcome_frame.empty:
-                outcome_frame = outcome_frame_partial
-            else:
-                outcome_frame = pd.concat(
-                    [
-                        outcome_frame,
-                        outcome_frame_partial
-                    ],
-                    axis=1
-                )
+            for outcome_set in labels_actual.keys()
+        ]
+        outcome_frame = pd.concat(outcome_frame_partials, axis=1)
 
         format_outcome_frame(
             sets_in_outcome=list(labels_actual.keys())
@@ -792,23 +868,18 @@ class ConversionPredictionModel(object):
 
     def remove_rows_from_original_flow(self):
         logger.info('  * Commencing accuracy metrics for negatives calculation')
-        self.user_profiles = pd.merge(
-            left=self.user_profiles,
-            right=self.browser_day_combinations_original_set[['date', 'browser_id', 'used_in_training']],
-            on=['date', 'browser_id'],
-            how='left'
-        )
+        # Anti-join on the (date, browser_id) keys, so that the wide joined frame never gets materialized
+        used_in_training = pd.MultiIndex.from_frame(self.browser_day_combinations_original_set[['date', 'browser_id']])
+        not_used_in_training = ~pd.MultiIndex.from_frame(
+            self.user_profiles[['date', 'browser_id']]
+        ).isin(used_in_training)
 
-        self.user_profiles = self.user_profiles[
-            self.user_profiles['used_in_training'].isna()
-        ].reset_index(drop=True)
-
-        self.user_profiles.drop('used_in_training', axis=1, inplace=True)
+        self.user_profiles = self.user_profiles[not_used_in_training].reset_index(drop=True)
 
     def model_training_pipeline(
             self,
             model_function=RandomForestClassifier,
-            model_arguments={'n_estimators': 250}
+            model_arguments={'n_estimators': 250, 'n_jobs': -1, 'max_samples': 0.3, 'max_features': 'sqrt'}
     ):
         '''
         Requires:
@@ -823,9 +894,13 @@ class ConversionPredictionModel(object):
             - feature_columns
             - model_date
             - path_to_model_files
-        Pipeline that outputs a trained model and it's accuracy measures
+        Pipeline that outputs a trained model and it's accuracy measures. Models that support it are trained on all
+        cores unless model_arguments set n_jobs explicitly
         '''
         logger.info(f'Executing training pipeline')
+        if 'n_jobs' in inspect.signature(model_function).parameters:
+            model_arguments = {'n_jobs': -1, **model_arguments}
+
         if self.user_profiles is None:
 
             # Make sure we have enough days for training, this statement is behind the condition since sometimes
@@ -836,8 +911,11 @@ class ConversionPredictionModel(object):
             self.create_feature_frame(data_retrieval_mode=DataRetrievalMode.MODEL_TRAIN_DATA)
 
         if self.overwrite_files:
-            for model_file in ['category_lists', 'scaler', 'model']:
-                self.delete_existing_model_file_for_same_date(model_file)
+            # Same date as the one set when splitting train / test, which names the newly stored files
+            self.model_date = self.user_profiles['date'].max() + timedelta(days=1)
+            existing_files = set(os.listdir(self.path_to_model_files or '.'))
+            for model_file in ['category_lists', 'column_transformer', 'model']:
+                self.delete_existing_model_file_for_same_date(model_file, existing_files)
 
         self.train_model(
             model_function,
@@ -846,19 +924,38 @@ class ConversionPredictionModel(object):
 
         logger.info(f'Training ready, dumping to file')
 
-        joblib.dump(
-            self.model,
-            f'{self.path_to_model_files}model_{self.model_date}.pkl'
-        )
+        self.dump_model()
 
         logger.info(f'Saved to {self.path_to_model_files}model_{self.model_date}.pkl')
 
         self.remove_model_training_artefacts()
         # TODO: This would eventually be replaced with storing variable importances to DB
-        self.variable_importances.to_csv(
-            f'{self.path_to_model_files}variable_importances_{self.model_date}.csv',
-            index=True,
-            header=False
+        joblib.dump(
+            self.variable_importances,
+            f'{self.path_to_model_files}variable_importances_{self.model_date}.pkl',
+            protocol=pickle.HIGHEST_PROTOCOL
+        )
+
+    def dump_model(self):
+        '''
+        Requires:
+            - model
+            - le
+            - feature_columns
+            - model_date
+            - path_to_model_files
+        Stores the model together with the label encoder and feature columns it was trained with, so that prediction
+        decodes the classes with the same label encoder and checks its features against the trained ones
+        '''
+        joblib.dump(
+            {
+                'model': self.model,
+                'label_encoder': self.le,
+                'feature_columns': self.feature_columns
+            },
+            f'{self.path_to_model_files}model_{self.model_date}.pkl',
+            compress=MODEL_COMPRESSION,
+            protocol=pickle.HIGHEST_PROTOCOL
         )
 
     def remove_model_training_artefacts(self):
@@ -877,20 +974,41 @@ class ConversionPredictionModel(object):
         Serves for the prediction pipeline in order to load model & additional transformation config objects
         '''
 
-        model_related_file_list = os.listdir(self.path_to_model_files)
-        last_model_related_files = {}
-        for model_related_file in ['category_lists', 'scaler', 'model', 'variable_importances']:
-            last_file_date = {parse(re.sub(f'{model_related_file}_|.json|.pkl|.csv|None', '', filename)):
-                              abs(parse(re.sub(f'{model_related_file}_|.json|.pkl|.csv|None', '', filename)).date()
-                                  - self.scoring_date.date())
-                              for filename in model_related_file_list
-                              if re.search(f'{model_related_file}_', filename)}
-            last_file_date = [date for date, diff in last_file_date.items() if diff == min(last_file_date.values())][0]
-            last_model_related_files[model_related_file] = last_file_date.date()
+        model_related_file_dates = {
+            model_related_file: [] for model_related_file in [
+                'category_lists', 'column_transformer', 'scaler', 'model', 'variable_importances'
+            ]
+        }
+        # Every filename is matched and parsed only once
+        for filename in os.listdir(self.path_to_model_files):
+            model_related_file_match = MODEL_RELATED_FILE_PATTERN.match(filename)
+            if model_related_file_match:
+                model_related_file, file_date = model_related_file_match.groups()
+                model_related_file_dates[model_related_file].append(parse(file_date).date())
+
+        # Models trained before the column transformer was introduced only stored the scaler
+        transformation_file = 'column_transformer' \
+            if model_related_file_dates['column_transformer'] or not model_related_file_dates['scaler'] else 'scaler'
+        model_related_file_dates = {
+            model_related_file: model_related_file_dates[model_related_file]
+            for model_related_file in ['category_lists', transformation_file, 'model', 'variable_importances']
+        }
+        for model_related_file, file_dates in model_related_file_dates.items():
+            if not file_dates:
+                raise ValueError(
+                    f'No {model_related_file} files found in {self.path_to_model_files or os.getcwd()}, '
+                    f'expected files named {model_related_file}_<YYYY-MM-DD>'
+                )
+
+        scoring_date = self.scoring_date.date()
+        last_model_related_files = {
+            model_related_file: min(file_dates, key=lambda file_date: abs(file_date - scoring_date))
+            for model_related_file, file_dates in model_related_file_dates.items()
+        }
         if len(set(last_model_related_files.values())) > 1:
             raise ValueError(f'''Unaligned model file dates
                 category_list date: {last_model_related_files['category_lists']}
-                scaler date: {last_model_related_files['scaler']}
+                {transformation_file} date: {last_model_related_files[transformation_file]}
                 model date: {last_model_related_files['model']}
                 'variable importances': {last_model_related_files['variable_importances']}
                 ''')
@@ -901,18 +1019,66 @@ class ConversionPredictionModel(object):
                   'category_lists_' + str(last_model_related_files['category_lists']) + '.json', 'r') as outfile:
             self.category_list_dict = json.load(outfile)
 
-        self.scaler = joblib.load(f"{self.path_to_model_files}scaler_{str(last_model_related_files['scaler'])}.pkl")
-        self.model = joblib.load(f"{self.path_to_model_files}model_{str(last_model_related_files['model'])}.pkl")
+        if transformation_file == 'column_transformer':
+            self.column_transformer = joblib.load(
+                f"{self.path_to_model_files}column_transformer_{last_model_related_files['column_transformer']}.pkl"
+            )
+            self.scaler = self.column_transformer.named_transformers_['numeric']
+        else:
+            self.column_transformer = None
+            self.scaler = joblib.load(f"{self.path_to_model_files}scaler_{str(last_model_related_files['scaler'])}.pkl")
+        model_bundle = joblib.load(f"{self.path_to_model_files}model_{str(last_model_related_files['model'])}.pkl")
+        # Older model files hold just the model, the label encoder and feature columns built at init are used for those
+        if isinstance(model_bundle, dict):
+            self.model = model_bundle['model']
+            self.le = model_bundle['label_encoder']
+            # The prediction feature frame is built with the feature columns from init before the model gets loaded,
+            # the stored ones are only compared against them, the fitted column transformer selects the features
+            self.validate_feature_columns(model_bundle['feature_columns'])
+        else:
+            self.model = model_bundle
         #TODO: This would eventually be replaced with loading variable importances from DB
-        self.variable_importances = pd.read_csv(
-                f"{self.path_to_model_files}variable_importances_{str(last_model_related_files['variable_importances'])}.csv",
-                squeeze=True,
-                index_col=0,
-                header=None
-        )
+        self.variable_importances = self.load_variable_importances(last_model_related_files['variable_importances'])
 
         logger.info('  * Model constructs loaded')
 
+    def validate_feature_columns(self, trained_feature_columns: FeatureColumns):
+        '''
+        Requires:
+            - feature_columns
+        Warns when the features used for prediction differ from the ones the model was trained with, which happens
+        e.g. when optional MySQL features failed to load in one of the runs. Prediction still goes ahead, trained
+        columns missing from the prediction data are filled with 0 and unexpected ones are dropped
+        :param trained_feature_columns:
+        :return:
+        '''
+        for column_set in [
+            'numeric_columns_with_window_variants', 'categorical_columns', 'bool_columns', 'config_columns'
+        ]:
+            trained_columns = set(getattr(trained_feature_columns, column_set))
+            prediction_columns = set(getattr(self.feature_columns, column_set))
+            if trained_columns != prediction_columns:
+                logger.warning(
+                    f'{column_set} differ from the ones the model was trained with, '
+                    f'missing: {sorted(trained_columns - prediction_columns)}, '
+                    f'unexpected: {sorted(prediction_columns - trained_columns)}'
+                )
+
+    def load_variable_importances(self, file_date) -> pd.Series:
+        '''
+        Requires:
+            - path_to_model_files
+        Loads the variable importances stored for a model date, models trained before the importances were pickled
+        stored them as a headerless CSV
+        :param file_date:
+        :return:
+        '''
+        path = f'{self.path_to_model_files}variable_importances_{file_date}'
+        if os.path.exists(f'{path}.pkl'):
+            return joblib.load(f'{path}.pkl')
+
+        return pd.read_csv(f'{path}.csv', index_col=0, header=None).iloc[:, 0].rename(None).rename_axis(None)
+
     def batch_predict(self, data):
         '''
         Requires:
@@ -932,39 +1098,35 @@ class ConversionPredictionModel(object):
         if self.model is None:
             self.load_model_related_constructs()
 
-        feature_frame_numeric = pd.DataFrame(
-            self.scaler.transform(
-                data[
-                    self.feature_columns.numeric_columns_with_window_variants]
-            ),
+        data = data.sort_index()
+        if self.column_transformer is not None:
+            feature_names = self.column_transformer_feature_names()
+        else:
+            feature_names = list(self.variable_importances.index)
+        features = np.empty((len(data), len(feature_names)), dtype=np.float32)
+        probabilities = np.empty((len(data), len(self.model.classes_)), dtype=np.float32)
+        # Transforming and scoring in batches bounds the memory taken by the transformer input and its float64 output
+        # to a single batch, results are written straight into the preallocated arrays
+        for start in range(0, len(data), PREDICTION_BATCH_SIZE):
+            end = start + PREDICTION_BATCH_SIZE
+            features[start:end] = np.nan_to_num(self.prediction_features(data.iloc[start:end]), copy=False)
+            probabilities[start:end] = self.model.predict_proba(features[start:end])
+
+        self.prediction_data = pd.DataFrame(
+            features,
             index=data.index,
-            columns=self.feature_columns.numeric_columns_with_window_variants).sort_index()
-
-        self.prediction_data = pd.concat([
-            feature_frame_numeric, data[
-                [column for column in data.columns
-                 if column not in self.feature_columns.numeric_columns_with_window_variants +
-                 self.feature_columns.config_columns +
-                 self.feature_columns.bool_columns]].sort_index()], axis=1)
-
-        self.prediction_data = self.replace_dummy_columns_with_dummies(self.prediction_data)
-
-        self.align_prediction_frame_with_train_columns()
+            columns=feature_names,
+            copy=False
+        )
 
         logger.info('  * Prediction data ready')
-        self.prediction_data.fillna(0.0, inplace=True)
-        if not self.X_train.empty:
-            for column in [column for column in self.X_train.columns if column not in self.prediction_data.columns]:
-                self.prediction_data[column] = 0.0
-            self.prediction_data = self.prediction_data[list(self.X_train.columns)]
-        predictions = pd.DataFrame(self.model.predict_proba(self.prediction_data))
+        predictions = pd.DataFrame(probabilities)
         logger.info('  * Prediction generation success, handling artifacts')
 
-        label_range = range(len(LABELS))
-
-        for i in label_range:
-            predictions.columns = [re.sub(str(i), self.le.inverse_transform([i])[0] + '_probability', str(column))
-                                   for column in predictions.columns]
+        # predict_proba columns follow the order of the model classes
+        predictions.columns = [
+            f'{label}_probability' for label in self.le.inverse_transform(self.model.classes_)
+        ]
         # We are adding outcome only for the sake of the batch test approach, we'll be dropping it in the actual
         # prediction pipeline
         self.predictions = pd.concat(
@@ -972,24 +1134,61 @@ class ConversionPredictionModel(object):
              predictions],
             axis=1
         )
-        self.predictions['predicted_outcome'] = self.le.inverse_transform(self.model.predict(self.prediction_data))
-
-    def align_prediction_frame_with_train_columns(self):
-        # Sometimes the columns used to train a model don't align with columns im prediction set
-        # 1. Drop columns that are in new data, but weren't used in training
-        self.prediction_data.drop(
-            [column for column in self.prediction_data.columns if column not in self.variable_importances.index],
-            axis=1,
-            inplace=True
-        )
+        self.predictions['predicted_outcome'] = self.le.inverse_transform(self.labels_from_probabilities(probabilities))
 
-        # 2. Add 0 columns that were in train, but aren't in new data
-        for column in [column for column in self.variable_importances.index
-                       if column not in self.prediction_data.columns]:
-            self.prediction_data[column] = 0.0
+    def prediction_features(self, data: pd.DataFrame) -> np.array:
+        '''
+        Requires:
+            - column_transformer or (for models trained before it was introduced) scaler
+        Transforms prediction data into the features the model was trained on, in train column order
+        :param data:
+        :return:
+        '''
+        if self.column_transformer is not None:
+            # The fitted transformer outputs the train columns in train order, so no further alignment is needed
+            return self.column_transformer.transform(self.column_transformer_input(data))
 
-        # 3. Make sure the columns have the same order as original data, since sklearn ignores column names
-        self.prediction_data = self.prediction_data[list(self.variable_importances.index)]
+        return self.legacy_prediction_features(data).to_numpy(dtype=np.float32)
+
+    def legacy_prediction_features(self, data: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Requires:
+            - scaler
+            - category_list_dict
+            - variable_importances
+            - feature_columns
+        Builds prediction features for models stored before the column transformer was introduced. Categories unseen
+        in training are encoded as Unknown, whose dummy column wasn't used in training, and the columns are aligned
+        with the train columns listed in the variable importances
+        :param data:
+        :return:
+        '''
+        numeric_columns = self.feature_columns.numeric_columns_with_window_variants
+        categorical_columns = list(self.feature_columns.categorical_columns)
+        excluded_columns = self.feature_columns.return_scaled_config_and_bool_columns() | set(categorical_columns)
+
+        numeric = pd.DataFrame(
+            self.scaler.transform(
+                data.reindex(columns=numeric_columns, fill_value=0.0).to_numpy(dtype=np.float32)
+            ),
+            index=data.index,
+            columns=numeric_columns
+        )
+        dummies = []
+        for column in categorical_columns:
+            categories = self.category_list_dict[column]
+            column_dummies = pd.get_dummies(
+                pd.Categorical(data[column].where(data[column].isin(categories), 'Unknown'), categories=categories),
+                prefix=column,
+                dtype=np.int8
+            )
+            column_dummies.index = data.index
+            dummies.append(column_dummies)
+
+        return pd.concat(
+            [numeric, data[[column for column in data.columns if column not in excluded_columns]]] + dummies,
+            axis=1
+        ).reindex(columns=self.variable_importances.index, fill_value=0.0)
 
     def generate_and_upload_prediction(self):
         '''
@@ -1023,24 +1222,18 @@ class ConversionPredictionModel(object):
         # Dry run tends to be used for testing new models, so we want to be able to calculate accuracy metrics
         if not self.dry_run:
             self.predictions.drop('outcome', axis=1, inplace=True)
+            self.predictions['browser_id'] = self.predictions['browser_id'].astype(str)
 
             logger.info(f'Storing predicted data')
             database = os.getenv('BIGQUERY_PROJECT_ID')
-            _, db_connection = create_connection(
-                f'bigquery://{database}',
-                engine_kwargs={'credentials_path': '../../gcloud_client_secrets.json'}
-            )
-
-
-            credentials = service_account.Credentials.from_service_account_file(
-                '../../gcloud_client_secrets.json',
-            )
 
+            # Uploading in chunks caps the memory the serialized load payload takes on large scoring runs
             self.predictions.to_gbq(
                 destination_table='pythia.conversion_predictions_log',
                 project_id=database,
-                credentials=credentials,
-                if_exists='append'
+                credentials=self.bq_credentials,
+                if_exists='append',
+                chunksize=PREDICTIONS_UPLOAD_CHUNK_SIZE
             )
 
             self.prediction_job_log = self.predictions[
@@ -1050,7 +1243,7 @@ class ConversionPredictionModel(object):
             self.prediction_job_log.to_gbq(
                 destination_table='pythia.prediction_job_log',
                 project_id=database,
-                credentials=credentials,
+                credentials=self.bq_credentials,
                 if_exists='append',
             )
         else:
@@ -1107,9 +1300,10 @@ if __name__ == "__main__":
                         default={'split': 'time_based', 'split_ratio': 6 / 10},
                         required=False)
     parser.add_argument('--model-arguments',
-                        help='Parameters for scikit model training',
+                        help='Parameters for scikit model training, max_samples sets the share of rows each tree is '
+                             'bootstrapped from',
                         type=json.loads,
-                        default={'n_estimators': 250},
+                        default={'n_estimators': 250, 'n_jobs': -1, 'max_samples': 0.3, 'max_features': 'sqrt'},
                         required=False)
     parser.add_argument('--overwrite-files',
                         help='Bool implying whether newly trained model should overwrite existing one for the same date',
@@ -1134,7 +1328,7 @@ if __name__ == "__main__":
             )
 
         conversion_prediction.model_training_pipeline(
-            model_arguments={'n_estimators': 250}
+            model_arguments=args['model_arguments']
         )
 
         metrics = ['precision', 'recall', 'f1_score', 'suport']
@@ -0,0 +1,42 @@
+import sys
+import unittest
+import pandas as pd
+from unittest.mock import MagicMock, patch
+
+# utils.bigquery maps the BigQuery tables on import, the connection and table reflection are replaced for the test
+sys.modules.pop('utils.bigquery', None)
+with patch('utils.db_utils.create_connection', return_value=(None, MagicMock())), \
+        patch('sqlalchemy.MetaData'), patch('sqlalchemy.Table'):
+    from utils import bigquery
+
+QUERY_COLUMNS = [
+    'anon_1_date', 'anon_1_browser_id', 'anon_1_date_w_gaps', 'anon_1_is_active_on_date', 'anon_1_pageviews'
+]
+
+
+class FeatureFrameTest(unittest.TestCase):
+    def get_feature_frame(self, feature_frame_chunks):
+        with patch.object(bigquery, 'get_full_features_query'), \
+                patch.object(bigquery, 'create_bqstorage_engine'), \
+                patch.object(bigquery, 'bq_session') as bq_session, \
+                patch.object(bigquery.pd, 'read_sql', return_value=iter(feature_frame_chunks)):
+            bq_session.query.return_value.statement.columns.keys.return_value = QUERY_COLUMNS
+
+            return bigquery.get_feature_frame_via_sqlalchemy('2020-01-01', '2020-01-02')
+
+    def test_empty_result_has_the_columns_of_a_fetched_one(self):
+        feature_frame_chunk = pd.DataFrame(
+            [['2020-01-01', 'browser', '2020-01-01', True, 1.0]],
+            columns=QUERY_COLUMNS
+        )
+
+        feature_frame = self.get_feature_frame([feature_frame_chunk])
+        empty_feature_frame = self.get_feature_frame([])
+
+        self.assertListEqual(['date', 'browser_id', 'is_active_on_date', 'pageviews'], list(feature_frame.columns))
+        self.assertListEqual(list(feature_frame.columns), list(empty_feature_frame.columns))
+        self.assertEqual(0, len(empty_feature_frame))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from copy import deepcopy
+import numpy as np
+import pandas as pd
+from datetime import date
+from unittest.mock import MagicMock, patch
+from sklearn.preprocessing import MinMaxScaler
+
+# utils.bigquery maps the BigQuery tables on import, which needs credentials and a connection
+sys.modules['utils.bigquery'] = MagicMock()
+from run import ConversionPredictionModel
+
+NUMERIC_COLUMNS = ['pageviews_avg_0', 'pageviews_avg_1']
+CATEGORICAL_COLUMNS = ['device', 'browser']
+BOOL_COLUMNS = ['is_desktop']
+CONFIG_COLUMNS = ['date', 'browser_id', 'user_ids']
+
+
+def dummies_with_unknown(data, category_list_dict):
+    # Previous dummification, categories missing from the category lists are encoded as the dropped Unknown
+    dummies = []
+    for column in CATEGORICAL_COLUMNS:
+        column_data = data[column].where(data[column].isin(category_list_dict[column]), 'Unknown')
+        column_dummies = pd.get_dummies(pd.Categorical(column_data, categories=category_list_dict[column]))
+        column_dummies.columns = [column + '_' + dummy_column for dummy_column in column_dummies.columns]
+        column_dummies.drop(columns=column + '_Unknown', inplace=True)
+        column_dummies.index = data.index
+        dummies.append(column_dummies)
+
+    return dummies
+
+
+def reference_features(data, scaler, category_list_dict):
+    # Previous feature handling, scaled numeric columns, the remaining columns and the dummies concatenated
+    numeric = pd.DataFrame(
+        scaler.transform(data[NUMERIC_COLUMNS].fillna(0)),
+        index=data.index,
+        columns=NUMERIC_COLUMNS
+    )
+    excluded_columns = NUMERIC_COLUMNS + CATEGORICAL_COLUMNS + BOOL_COLUMNS + CONFIG_COLUMNS + ['outcome']
+
+    return pd.concat(
+        [numeric, data[[column for column in data.columns if column not in excluded_columns]]] +
+        dummies_with_unknown(data, category_list_dict),
+        axis=1
+    ).astype(np.float32)
+
+
+class ColumnTransformerTest(unittest.TestCase):
+    def setUp(self):
+        self.path_to_model_files = tempfile.mkdtemp() + '/'
+        # The configured model directory takes precedence over the argument, the test must not write into it
+        with patch.dict(os.environ, {'PATH_TO_MODEL_FILES': self.path_to_model_files}):
+            self.model = ConversionPredictionModel(
+                min_date=date(2020, 1, 1),
+                max_date=date(2020, 1, 2),
+                training_split_parameters={'split': 'random', 'split_ratio': 0.5},
+                path_to_model_files=self.path_to_model_files
+            )
+        self.model.feature_columns.numeric_columns_with_window_variants = NUMERIC_COLUMNS
+        self.model.feature_columns.categorical_columns = CATEGORICAL_COLUMNS
+        self.model.feature_columns.bool_columns = BOOL_COLUMNS
+        self.model.feature_columns.config_columns = CONFIG_COLUMNS
+        self.model.user_profiles = pd.DataFrame({
+            'date': [date(2020, 1, 1)] * 4 + [date(2020, 1, 2)] * 4,
+            'browser_id': [f'browser_{i}' for i in range(8)],
+            'user_ids': [[]] * 8,
+            'outcome': ['no_conversion', 'conversion'] * 4,
+            'device': ['Desktop', 'Mobile', 'Desktop', 'Tablet', 'Mobile', 'Desktop', 'Other', 'Mobile'],
+            'browser': ['Chrome', 'Firefox', 'Chrome', 'Other', 'Chrome', 'Safari', 'Firefox', 'Chrome'],
+            'is_desktop': [1, 0, 1, 0, 0, 1, 0, 0],
+            'pageviews_avg_0': [1.0, 5.0, np.nan, 2.0, 8.0, 0.0, 3.0, 4.0],
+            'pageviews_avg_1': [0.5, 1.5, 2.5, np.nan, 0.0, 1.0, 2.0, 3.0],
+            'checkouts': [0, 1, 0, 2, 1, 0, 0, 3],
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.path_to_model_files)
+
+    def assert_matches_reference(self, features, reference):
+        self.assertSetEqual(set(reference.columns), set(features.columns))
+        np.testing.assert_allclose(
+            features.to_numpy(),
+            reference.reindex(columns=features.columns).to_numpy(),
+            rtol=1e-6
+        )
+
+    def test_train_and_test_features_match_previous_handling(self):
+        self.model.create_train_test_transformations()
+
+        # Features are handed to the model as they come out of the transformer, without any further downcasting
+        self.assertSetEqual({np.dtype(np.float32)}, set(self.model.X_train.dtypes) | set(self.model.X_test.dtypes))
+        train = self.model.user_profiles.loc[self.model.X_train.index]
+        test = self.model.user_profiles.loc[self.model.X_test.index]
+        scaler = MinMaxScaler().fit(train[NUMERIC_COLUMNS].fillna(0))
+
+        self.assert_matches_reference(
+            self.model.X_train,
+            reference_features(train, scaler, self.model.category_list_dict)
+        )
+        self.assert_matches_reference(
+            self.model.X_test,
+            reference_features(test, scaler, self.model.category_list_dict)
+        )
+
+    def test_prediction_features_encode_unseen_categories_as_unknown(self):
+        self.model.create_train_test_transformations()
+        prediction_data = self.model.user_profiles.copy()
+        prediction_data[NUMERIC_COLUMNS] = prediction_data[NUMERIC_COLUMNS].fillna(0)
+        # Smart TV and Edge weren't present in the train set
+        prediction_data['device'] = ['Desktop', 'Smart TV', 'Mobile', 'Other', 'Tablet', 'Smart TV', 'Other', 'Mobile']
+        prediction_data['browser'] = ['Edge', 'Chrome', 'Firefox', 'Safari', 'Other', 'Chrome', 'Edge', 'Firefox']
+
+        scaler = MinMaxScaler().fit(
+            self.model.user_profiles.loc[self.model.X_train.index, NUMERIC_COLUMNS].fillna(0)
+        )
+        features = pd.DataFrame(
+            self.model.prediction_features(prediction_data),
+            index=prediction_data.index,
+            columns=self.model.column_transformer_feature_names()
+        )
+
+        self.assert_matches_reference(
+            features,
+            reference_features(prediction_data, scaler, self.model.category_list_dict)
+        )
+
+    def test_prediction_features_fill_trained_columns_missing_from_data(self):
+        self.model.create_train_test_transformations()
+        prediction_data = self.model.user_profiles.drop(columns=['pageviews_avg_1', 'browser'])
+        prediction_data['pageviews_avg_0'] = prediction_data['pageviews_avg_0'].fillna(0)
+        prediction_data['unexpected'] = 1.0
+
+        scaler = MinMaxScaler().fit(
+            self.model.user_profiles.loc[self.model.X_train.index, NUMERIC_COLUMNS].fillna(0)
+        )
+        features = pd.DataFrame(
+            self.model.prediction_features(prediction_data),
+            index=prediction_data.index,
+            columns=self.model.column_transformer_feature_names()
+        )
+
+        reference_data = prediction_data.drop(columns=['unexpected']).assign(pageviews_avg_1=0.0, browser='Unknown')
+        self.assert_matches_reference(
+            features,
+            reference_features(reference_data, scaler, self.model.category_list_dict)
+        )
+
+    def test_differing_feature_columns_are_logged(self):
+        trained_feature_columns = deepcopy(self.model.feature_columns)
+        trained_feature_columns.numeric_columns_with_window_variants = NUMERIC_COLUMNS + ['clv']
+
+        with self.assertLogs('run', level='WARNING') as logs:
+            self.model.validate_feature_columns(trained_feature_columns)
+
+        self.assertEqual(1, len(logs.output))
+        self.assertIn("missing: ['clv']", logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import numpy as np
+import pandas as pd
+from utils.data_transformations import unique_lists, row_wise_normalization
+
+
+def unique_list(list_to_simplify):
+    # Per row implementation replaced by unique_lists, kept as the reference for its output
+    list_to_simplify = set(list_to_simplify)
+    list_to_simplify = list(list_to_simplify)
+    list_to_simplify = [element for element in list_to_simplify
+                        if len(element) > 0 and element != 'empty_user_id']
+
+    return list_to_simplify
+
+
+def reference_row_wise_normalization(data):
+    # Previous normalization, followed by the fillna the caller used to apply
+    with np.errstate(invalid='ignore'):
+        normalized_data = np.array([[data[i, j] / np.sum(data[i, :])
+                                     for j in range(data.shape[1])] for i in range(data.shape[0])])
+
+    return pd.DataFrame(normalized_data).fillna(0.0).to_numpy()
+
+
+class UniqueListsTest(unittest.TestCase):
+    def test_matches_per_row_deduplication(self):
+        user_ids = pd.Series(
+            [['1', '2', '1'], ['', 'empty_user_id'], [], ['3'], ['2', '2', '', '4', 'empty_user_id']],
+            index=[3, 5, 7, 9, 11]
+        )
+
+        result = unique_lists(user_ids)
+        expected = user_ids.apply(unique_list)
+
+        self.assertListEqual(list(expected.index), list(result.index))
+        for result_list, expected_list in zip(result, expected):
+            self.assertListEqual(sorted(expected_list), sorted(result_list))
+
+    def test_missing_lists_become_empty(self):
+        user_ids = pd.Series([np.nan, ['1', '1'], None, ['empty_user_id']])
+
+        self.assertListEqual([[], ['1'], [], []], list(unique_lists(user_ids)))
+
+
+class RowWiseNormalizationTest(unittest.TestCase):
+    def test_matches_previous_normalization(self):
+        data = np.array([
+            [1.0, 3.0, 0.0],
+            [0.0, 0.0, 0.0],
+            [2.0, np.nan, 2.0],
+            [5.0, 5.0, 10.0],
+        ])
+        out = np.empty(data.shape, dtype=np.float32)
+
+        row_wise_normalization(data, out)
+
+        np.testing.assert_allclose(out, reference_row_wise_normalization(data), rtol=1e-6)
+
+    def test_writes_into_slice_of_wider_buffer(self):
+        # The caller passes column slices of one buffer holding all of the normalized column sets
+        data = np.array([[1.0, 1.0], [0.0, 4.0]])
+        buffer = np.full((2, 4), -1.0, dtype=np.float32)
+
+        row_wise_normalization(data, buffer[:, 1:3])
+
+        np.testing.assert_array_equal(
+            np.array([[-1.0, 0.5, 0.5, -1.0], [-1.0, 0.0, 1.0, -1.0]], dtype=np.float32),
+            buffer
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import pandas as pd
+from datetime import date
+from unittest.mock import MagicMock, patch
+
+# utils.bigquery maps the BigQuery tables on import, which needs credentials and a connection
+sys.modules['utils.bigquery'] = MagicMock()
+from run import ConversionPredictionModel
+
+
+class ModelFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.path_to_model_files = tempfile.mkdtemp() + '/'
+        # The configured model directory takes precedence over the argument, the test must not write into it
+        with patch.dict(os.environ, {'PATH_TO_MODEL_FILES': self.path_to_model_files}):
+            self.model = ConversionPredictionModel(
+                min_date=date(2020, 1, 1),
+                max_date=date(2020, 1, 2),
+                path_to_model_files=self.path_to_model_files
+            )
+        self.model.user_profiles = pd.DataFrame({'date': [date(2020, 1, 1), date(2020, 1, 2)]})
+
+    def tearDown(self):
+        shutil.rmtree(self.path_to_model_files)
+
+    def create_files(self, filenames):
+        for filename in filenames:
+            open(f'{self.path_to_model_files}{filename}', 'w').close()
+
+    def test_training_deletes_existing_files_for_the_same_date(self):
+        same_date_files = [
+            'category_lists_2020-01-03.json', 'column_transformer_2020-01-03.pkl', 'model_2020-01-03.pkl'
+        ]
+        other_date_files = ['category_lists_2020-01-02.json', 'model_2020-01-02.pkl']
+        self.create_files(same_date_files + other_date_files)
+
+        with patch.object(ConversionPredictionModel, 'train_model'), \
+                patch.object(ConversionPredictionModel, 'dump_model'):
+            self.model.model_training_pipeline()
+
+        remaining_files = set(os.listdir(self.path_to_model_files))
+        self.assertSetEqual(set(), remaining_files & set(same_date_files))
+        self.assertSetEqual(set(other_date_files), remaining_files & set(other_date_files))
+
+    def test_training_keeps_existing_files_without_overwrite(self):
+        same_date_files = ['category_lists_2020-01-03.json', 'model_2020-01-03.pkl']
+        self.create_files(same_date_files)
+        self.model.overwrite_files = False
+
+        with patch.object(ConversionPredictionModel, 'train_model'), \
+                patch.object(ConversionPredictionModel, 'dump_model'):
+            self.model.model_training_pipeline()
+
+        self.assertTrue(set(same_date_files) <= set(os.listdir(self.path_to_model_files)))
+
+
+if __name__ == '__main__':
+    unittest.main()
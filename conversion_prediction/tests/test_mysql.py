@@ -0,0 +1,82 @@
+import unittest
+import sqlalchemy
+from datetime import date, datetime, timedelta
+from unittest.mock import patch
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.sql.expression import Cast
+from sqlalchemy.types import DATE
+from utils.mysql import get_global_context
+
+START_DATE = date(2020, 1, 1)
+
+
+@compiles(Cast, 'sqlite')
+def compile_sqlite_cast(element, compiler, **kwargs):
+    # sqlite has no DATE type, its date function truncates the stored ISO strings the same way the mysql cast does
+    if isinstance(element.type, DATE):
+        return f'date({compiler.process(element.clause, **kwargs)})'
+
+    return compiler.visit_cast(element, **kwargs)
+
+
+def datediff(first_date, second_date):
+    return (datetime.strptime(first_date, '%Y-%m-%d') - datetime.strptime(second_date, '%Y-%m-%d')).days
+
+
+def day(day_number):
+    return str(START_DATE + timedelta(days=day_number))
+
+
+def create_context_tables(payments_by_day, article_pageviews_by_day):
+    engine = sqlalchemy.create_engine('sqlite://', poolclass=StaticPool)
+    sqlalchemy.event.listen(
+        engine, 'connect', lambda connection, _: connection.create_function('datediff', 2, datediff)
+    )
+    meta = MetaData()
+    payments = Table(
+        'payments', meta,
+        Column('id', Integer, primary_key=True), Column('created_at', String),
+        Column('amount', Float), Column('status', String)
+    )
+    article_pageviews = Table('article_pageviews', meta, Column('time_from', String), Column('sum', Float))
+    meta.create_all(engine)
+    engine.execute(payments.insert(), [
+        {'created_at': day(day_number), 'amount': amount, 'status': 'paid'} for day_number, amount in payments_by_day
+    ])
+    engine.execute(article_pageviews.insert(), [
+        {'time_from': day(day_number), 'sum': pageviews} for day_number, pageviews in article_pageviews_by_day
+    ])
+
+    def get_sqlalchemy_tables_w_session(db_connection_string_name, schema, table_names):
+        table_mapping = {table: meta.tables[table] for table in table_names}
+        table_mapping['session'] = sessionmaker(bind=engine)()
+
+        return table_mapping
+
+    return get_sqlalchemy_tables_w_session
+
+
+class GlobalContextTest(unittest.TestCase):
+    def test_rolling_window_covers_calendar_days(self):
+        # Days 2 to 9 have no data, the window of day 10 reaches back to day 4 only, while a rolling sum over the
+        # last 7 returned rows would still include days 0 and 1
+        get_sqlalchemy_tables_w_session = create_context_tables(
+            payments_by_day=[(0, 10.0), (1, 20.0), (10, 30.0)],
+            article_pageviews_by_day=[(0, 100.0), (1, 200.0), (10, 300.0)]
+        )
+
+        with patch('utils.mysql.get_sqlalchemy_tables_w_session', get_sqlalchemy_tables_w_session):
+            context = get_global_context(day(0), day(10)).set_index('date')
+
+        self.assertListEqual([date(2020, 1, 1), date(2020, 1, 2), date(2020, 1, 11)], list(context.index))
+        self.assertListEqual([1.0, 3.0, 1.0], list(context['payment_count']))
+        self.assertListEqual([10.0, 40.0, 30.0], list(context['sum_paid']))
+        self.assertListEqual([100.0, 400.0, 300.0], list(context['article_pageviews_count']))
+        self.assertListEqual([10.0, 40.0 / 3, 30.0], list(context['avg_price']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,16 +5,26 @@ from sqlalchemy.types import Float, DATE, String
 from sqlalchemy import and_, func, case, text
 from sqlalchemy.sql.expression import cast
 from datetime import timedelta, datetime
+from functools import lru_cache
 from .config import build_derived_metrics_config, PROFILE_COLUMNS, LABELS, generate_4_hour_interval_column_names, \
     SUPPORTED_JSON_FIELDS_KEYS
 from typing import List, Dict, Any
 import os
+import sqlalchemy
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import MetaData, Table
+from google.cloud import bigquery, bigquery_storage_v1
+from google.cloud.bigquery import dbapi
+from google.oauth2 import service_account
 from .db_utils import create_connection
 from .enums import DataRetrievalMode
 
 
+FEATURE_FRAME_CHUNK_SIZE = 100000
+GCLOUD_CREDENTIALS_PATH = os.getenv('GCLOUD_CREDENTIALS_SERVICE_ACCOUNT_JSON_KEY_PATH') or \
+    '../../gcloud_client_secrets.json'
+
+
 def get_sqla_table(table_name, engine):
     meta = MetaData(bind=engine)
     table = Table(table_name, meta, autoload=True, autoload_with=engine)
@@ -42,6 +52,26 @@ def get_sqlalchemy_tables_w_session(
     return table_mapping
 
 
+@lru_cache(maxsize=None)
+def create_bqstorage_engine(credentials_path: str) -> sqlalchemy.engine.Engine:
+    '''
+    Creates an engine whose DB-API connections carry a BigQuery Storage client, so that result sets are
+    downloaded as streamed Arrow / Avro blocks rather than paged row by row through the REST API. The engine is
+    created on first use and reused afterwards
+    :param credentials_path:
+    :return:
+    '''
+    database = os.getenv('BIGQUERY_PROJECT_ID')
+    credentials = service_account.Credentials.from_service_account_file(credentials_path)
+    client = bigquery.Client(project=database, credentials=credentials)
+    bqstorage_client = bigquery_storage_v1.BigQueryReadClient(credentials=credentials)
+
+    return sqlalchemy.create_engine(
+        f'bigquery://{database}',
+        creator=lambda: dbapi.connect(client, bqstorage_client)
+    )
+
+
 tables_to_map = (
     ['aggregated_browser_days', 'events'] +
     [f'aggregated_browser_days_{profile_feature_set_name}' for profile_feature_set_name in PROFILE_COLUMNS
@@ -52,7 +82,7 @@ tables_to_map = (
 bq_mappings = get_sqlalchemy_tables_w_session(
     schema='pythia',
     table_names=tables_to_map,
-    engine_kwargs={'credentials_path': '../../gcloud_client_secrets.json'}
+    engine_kwargs={'credentials_path': GCLOUD_CREDENTIALS_PATH}
 )
 
 bq_session = bq_mappings['session']
@@ -60,6 +90,11 @@ aggregated_browser_days = bq_mappings['aggregated_browser_days']
 events = bq_mappings['events']
 
 
+def feature_frame_column_names(columns: List[str]) -> List[str]:
+    # Columns selected from the features subquery come prefixed with its alias
+    return [re.sub('anon_1_', '', column) for column in columns]
+
+
 def get_feature_frame_via_sqlalchemy(
         start_time: datetime,
         end_time: datetime,
@@ -80,11 +115,33 @@ def get_feature_frame_via_sqlalchemy(
         positive_event_lookahead
     ))
 
-    feature_frame = pd.read_sql(full_query.statement, full_query.session.bind)
-    feature_frame.columns = [re.sub('anon_1_', '', column) for column in feature_frame.columns]
-    feature_frame['is_active_on_date'] = feature_frame['is_active_on_date'].astype(bool)
-    feature_frame['date'] = pd.to_datetime(feature_frame['date']).dt.tz_localize(None).dt.date
-    feature_frame.drop('date_w_gaps', axis=1, inplace=True)
+    # The result is fetched in chunks that are cleaned up and downcast as they arrive, so the full frame never exists
+    # in its raw float64 form
+    feature_frame_chunks = []
+    for feature_frame_chunk in pd.read_sql(
+            full_query.statement,
+            create_bqstorage_engine(GCLOUD_CREDENTIALS_PATH),
+            chunksize=FEATURE_FRAME_CHUNK_SIZE
+    ):
+        feature_frame_chunk.columns = feature_frame_column_names(feature_frame_chunk.columns)
+        feature_frame_chunk['is_active_on_date'] = feature_frame_chunk['is_active_on_date'].astype(bool)
+        feature_frame_chunk['date'] = pd.to_datetime(feature_frame_chunk['date']).dt.tz_localize(None).dt.date
+        feature_frame_chunk.drop('date_w_gaps', axis=1, inplace=True)
+        float_columns = feature_frame_chunk.select_dtypes(include='float64').columns
+        feature_frame_chunk[float_columns] = feature_frame_chunk[float_columns].astype('float32')
+        feature_frame_chunks.append(feature_frame_chunk)
+
+    if not feature_frame_chunks:
+        # Chunked reads yield nothing for an empty result, the frame keeps the columns of the query named the same
+        # way as the fetched chunks
+        return pd.DataFrame(
+            columns=[
+                column for column in feature_frame_column_names(full_query.statement.columns.keys())
+                if column != 'date_w_gaps'
+            ]
+        )
+
+    feature_frame = pd.concat(feature_frame_chunks, ignore_index=True, copy=False)
 
     return feature_frame
 
@@ -251,6 +251,10 @@ class FeatureColumns(object):
             'pageviews_count', 'avg_price'
         ]
     
+    def return_scaled_config_and_bool_columns(self) -> frozenset:
+        # Built on request rather than in __init__, since the add_* methods keep extending the numeric columns
+        return frozenset(self.numeric_columns_with_window_variants + self.config_columns + self.bool_columns)
+
     def return_feature_list(self):
         return (
                 self.categorical_columns +
@@ -1,28 +1,48 @@
-from numba import njit
+from numba import njit, prange
 import numpy as np
+import pandas as pd
 
 
-def unique_list(list_to_simplify):
-    list_to_simplify = set(list_to_simplify)
-    list_to_simplify = list(list_to_simplify)
-    list_to_simplify = [element for element in list_to_simplify
-                        if len(element) > 0 and element != 'empty_user_id']
+def unique_lists(lists_to_simplify: pd.Series) -> pd.Series:
+    '''
+    Deduplicates every list in a series of lists, dropping empty and placeholder elements. The lists are exploded
+    so that the deduplication runs on one flat series instead of a python function per row
+    :param lists_to_simplify:
+    :return:
+    '''
+    elements = lists_to_simplify.explode()
+    elements = elements[(elements.str.len() > 0) & (elements != 'empty_user_id')]
+    elements = elements[~pd.MultiIndex.from_arrays([elements.index, elements.values]).duplicated()]
+    simplified_lists = elements.groupby(level=0).agg(list).reindex(lists_to_simplify.index)
 
-    return list_to_simplify
+    return pd.Series(
+        [simplified_list if isinstance(simplified_list, list) else [] for simplified_list in simplified_lists],
+        index=lists_to_simplify.index
+    )
 
 
-@njit(parallel=True)
-def row_wise_normalization(data):
+@njit(parallel=True, error_model='numpy')
+def row_wise_normalization(data, out):
     '''
     Performs a row-wise normalization, meant to be used with profile level features such as count of pageviews in
     individual section where we want to have the number of pagevieews on a given section and / or share of pageviews
     in a given section on all pageviews as this might provide additional / less noisy information
     :param data:
+    :param out: buffer of the same shape as data the normalized values are written to, rows without any
+    pageviews (or with missing values) are filled with 0.0
     :return:
     '''
     N = data.shape[0]
     M = data.shape[1]
-    normalized_data = np.array([[data[i, j] / np.sum(data[i, :])
-                                 for j in range(M)] for i in range(N)])
+    for i in prange(N):
+        row_sum = 0.0
+        for j in range(M):
+            row_sum += data[i, j]
+        if row_sum == 0.0 or np.isnan(row_sum):
+            for j in range(M):
+                out[i, j] = 0.0
+        else:
+            for j in range(M):
+                out[i, j] = data[i, j] / row_sum
 
-    return normalized_data
+    return out
@@ -133,45 +133,69 @@ def get_global_context(start_time, end_time):
 
         return article_pageviews_filtered
 
-    payments_filtered_1 = get_payments_filtered()
-    payments_filtered_2 = get_payments_filtered()
+    def get_daily_context():
+        payments_filtered_1 = get_payments_filtered()
+        payments_filtered_2 = get_payments_filtered()
+
+        payments_context = mysql_predplatne_session.query(
+            payments_filtered_1.c['date'].label('date'),
+            func.sum(payments_filtered_2.c['payment_count']).label('payment_count'),
+            func.sum(payments_filtered_2.c['sum_paid']).label('sum_paid')
+        ).join(
+            payments_filtered_2,
+            func.datediff(payments_filtered_1.c['date'], payments_filtered_2.c['date']).between(0, 7)
+        ).group_by(
+            payments_filtered_1.c['date']
+        ).order_by(
+            payments_filtered_1.c['date']
+        ).subquery()
 
-    payments_context = mysql_predplatne_session.query(
-        payments_filtered_1.c['date'].label('date'),
-        func.sum(payments_filtered_2.c['payment_count']).label('payment_count'),
-        func.sum(payments_filtered_2.c['sum_paid']).label('sum_paid')
-    ).join(
-        payments_filtered_2,
-        func.datediff(payments_filtered_1.c['date'], payments_filtered_2.c['date']).between(0, 7)
-    ).group_by(
-        payments_filtered_1.c['date']
-    ).order_by(
-        payments_filtered_1.c['date']
-    ).subquery()
+        article_pageviews_filtered_1 = get_article_pageviews_filtered()
+        article_pageviews_filtered_2 = get_article_pageviews_filtered()
 
-    article_pageviews_filtered_1 = get_article_pageviews_filtered()
-    article_pageviews_filtered_2 = get_article_pageviews_filtered()
+        article_pageviews_context = mysql_beam_session.query(
+            article_pageviews_filtered_1.c['date'].label('date'),
+            func.sum(article_pageviews_filtered_2.c['article_pageviews']).label('article_pageviews_count'),
+        ).join(
+            article_pageviews_filtered_2,
+            func.datediff(article_pageviews_filtered_1.c['date'], article_pageviews_filtered_2.c['date']).between(0, 7)
+        ).group_by(
+            article_pageviews_filtered_1.c['date']
+        ).order_by(
+            article_pageviews_filtered_1.c['date']
+        ).subquery()
 
-    article_pageviews_context = mysql_beam_session.query(
-        article_pageviews_filtered_1.c['date'].label('date'),
-        func.sum(article_pageviews_filtered_2.c['article_pageviews']).label('article_pageviews_count'),
-    ).join(
-        article_pageviews_filtered_2,
-        func.datediff(article_pageviews_filtered_1.c['date'], article_pageviews_filtered_2.c['date']).between(0, 7)
-    ).group_by(
-        article_pageviews_filtered_1.c['date']
-    ).order_by(
-        article_pageviews_filtered_1.c['date']
-    ).subquery()
+        daily_context = mysql_predplatne_session.query(
+            payments_context.c['date'],
+            payments_context.c['payment_count'],
+            payments_context.c['sum_paid'],
+            article_pageviews_context.c['article_pageviews_count']
+        ).join(
+            article_pageviews_context,
+            article_pageviews_context.c['date'] == payments_context.c['date']
+        ).subquery()
+
+        return daily_context
+
+    # The rolling window of the final context is computed in mysql as well, using another self join over 7 days
+    daily_context_1 = get_daily_context()
+    daily_context_2 = get_daily_context()
 
     context_query = mysql_predplatne_session.query(
-        payments_context.c['date'],
-        payments_context.c['payment_count'],
-        payments_context.c['sum_paid'],
-        article_pageviews_context.c['article_pageviews_count']
+        daily_context_1.c['date'].label('date'),
+        func.sum(daily_context_2.c['payment_count']).label('payment_count'),
+        func.sum(daily_context_2.c['sum_paid']).label('sum_paid'),
+        func.sum(daily_context_2.c['article_pageviews_count']).label('article_pageviews_count'),
+        (
+            func.sum(daily_context_2.c['sum_paid']) / func.sum(daily_context_2.c['payment_count'])
+        ).label('avg_price')
     ).join(
-        article_pageviews_context,
-        article_pageviews_context.c['date'] == payments_context.c['date']
+        daily_context_2,
+        func.datediff(daily_context_1.c['date'], daily_context_2.c['date']).between(0, 6)
+    ).group_by(
+        daily_context_1.c['date']
+    ).order_by(
+        daily_context_1.c['date']
     )
 
     context = pd.read_sql(
@@ -179,6 +203,9 @@ def get_global_context(start_time, end_time):
         context_query.session.bind
     )
 
+    for column in ['payment_count', 'sum_paid', 'article_pageviews_count', 'avg_price']:
+        context[column] = context[column].astype(float)
+
     mysql_predplatne_session.close()
     mysql_beam_session.close()
 
@@ -5,6 +5,8 @@ from google.oauth2 import service_account
 from imblearn.under_sampling import RandomUnderSampler
 import json
 import os
+from glob import glob
+import pickle
 import re
 import pandas as pd
 import numpy as np
@@ -12,11 +14,11 @@ import sqlalchemy
 import joblib
 
 from datetime import datetime, timedelta
-from typing import List, Dict, Callable
+from typing import List, Dict, Callable, Set
 from dateutil.parser import parse
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import precision_recall_fscore_support
-from sklearn.preprocessing import MinMaxScaler, LabelEncoder
+from sklearn.preprocessing import MinMaxScaler, LabelEncoder, OneHotEncoder
 from sqlalchemy import func
 
 from prediction_commons.enums import SplitType, NormalizedFeatureHandling, ArtifactRetentionMode, \
@@ -25,6 +27,17 @@ from prediction_commons.data_transformations import row_wise_normalization
 from prediction_commons.db_utils import TableHandler, create_connection
 from prediction_commons.bq_schemas import rolling_daily_user_profile
 
+# Forest pickles are dominated by repetitive tree arrays, lz4 shrinks them at close to disk speed
+MODEL_COMPRESSION = ('lz4', 3)
+MODEL_RELATED_FILE_EXTENSIONS = {
+    'category_lists': ('json',),
+    'scaler': ('pkl',),
+    'one_hot_encoder': ('pkl',),
+    'model': ('pkl',),
+    # csv is the format variable importances were stored in before
+    'variable_importances': ('pkl', 'csv')
+}
+
 sys.path.append("../")
 
 # environment variables
@@ -90,6 +103,7 @@ class PredictionModel(object):
         self.Y_train_undersampled = pd.DataFrame()
         self.sampling_function = RandomUnderSampler()
         self.scaler = MinMaxScaler()
+        self.one_hot_encoder = None
         self.model_date = None
         self.training_split_parameters = training_split_parameters
         self.model = None
@@ -128,7 +142,9 @@ class PredictionModel(object):
             if artifact == ModelArtifacts.MODEL:
                 joblib.dump(
                     self.model,
-                    f'{self.path_to_model_files}model_{self.model_date}.pkl'
+                    f'{self.path_to_model_files}model_{self.model_date}.pkl',
+                    compress=MODEL_COMPRESSION,
+                    protocol=pickle.HIGHEST_PROTOCOL
                 )
             else:
                 getattr(self, artifact.value, pd.DataFrame()) \
@@ -243,55 +259,53 @@ class PredictionModel(object):
         for column in self.feature_columns.categorical_columns:
             self.category_list_dict[column] = list(self.user_profiles[column].unique()) + ['Unknown']
 
-    def encode_unknown_categories(self, data: pd.Series):
-        '''
-        In train and predictiom set, we mighr encounter categorie that weren't present in the test set, in order
-        to allow for the prediction algorithm to handle these, we create an Unknown category
-        :param data:
-        :return:
-        '''
-        data[~(data.isin(self.category_list_dict[data.name]))] = 'Unknown'
-
-        return data
-
-    def generate_dummy_columns_from_categorical_column(self, data: pd.Series) -> pd.DataFrame:
+    def fit_one_hot_encoder(self, data: pd.DataFrame):
         '''
         Requires:
             - category_lists_dict
-            - categorical column as an input
-        Generate 0/1 (values) columns from categorical columns handling the logic for Others and Unknown categories.
-        Always drops the Unknown columns (since we only need k-1 columns for k categories)
-        :param data: A column to encode
-        :return:
+        Fits the encoder generating 0/1 columns from categorical columns once, so that train set and prediction set
+        always get the same dummy columns in the same order. Categories that weren't present in the train set get all 0
+        dummy columns, which is the same as the dropped Unknown column (since we only need k-1 columns for k categories)
         '''
-        data = self.encode_unknown_categories(data.copy())
-        dummies = pd.get_dummies(pd.Categorical(data, categories=self.category_list_dict[data.name]))
-        dummies.columns = [data.name + '_' + dummy_column for dummy_column in dummies.columns]
-        dummies.drop(columns=data.name + '_Unknown', axis=1, inplace=True)
-        dummies.index = data.index
-
-        return dummies
+        categorical_columns = list(self.feature_columns.categorical_columns)
+        self.one_hot_encoder = OneHotEncoder(
+            # Categories are compared as strings, sklearn requires sorted lists for numeric categories
+            categories=[
+                list(dict.fromkeys(
+                    str(category) for category in self.category_list_dict[column] if category != 'Unknown'
+                ))
+                for column in categorical_columns
+            ],
+            handle_unknown='ignore',
+            sparse=False,
+            dtype=np.uint8
+        ).fit(data[categorical_columns].astype(str))
 
     def replace_dummy_columns_with_dummies(self, data: pd.DataFrame) -> pd.DataFrame:
         '''
         Requires:
-            - category_lists_dict
-        Generates new dummy columns and drops the original categorical ones
+            - one_hot_encoder
+        Generates new dummy columns named <column_name>_<column_value> and drops the original categorical ones
         :param data:
-        :param category_lists_dict:
         :return:
         '''
-        for column in self.feature_columns.categorical_columns:
-            dummies = self.generate_dummy_columns_from_categorical_column(data[column])
-            data = pd.concat(
-                [
-                    data,
-                    dummies
-                ],
-                axis=1)
-            data.drop(labels=column, axis=1, inplace=True)
+        if self.one_hot_encoder is None:
+            # Models stored before the encoder was introduced only come with their category lists, since the categories
+            # are fixed by them, fitting on the data at hand gives the same encoder
+            self.fit_one_hot_encoder(data)
+
+        categorical_columns = list(self.feature_columns.categorical_columns)
+        dummies = pd.DataFrame(
+            self.one_hot_encoder.transform(data[categorical_columns].astype(str)),
+            index=data.index,
+            columns=[
+                f'{column}_{category}'
+                for column, categories in zip(categorical_columns, self.one_hot_encoder.categories_)
+                for category in categories
+            ]
+        )
 
-        return data
+        return pd.concat([data.drop(columns=categorical_columns), dummies], axis=1)
 
     def create_train_test_transformations(self):
         '''
@@ -326,6 +340,13 @@ class PredictionModel(object):
                 f'{self.path_to_model_files}category_lists_{self.model_date}.json', 'w') as outfile:
             json.dump(self.category_list_dict, outfile)
 
+        self.fit_one_hot_encoder(self.user_profiles)
+        joblib.dump(
+            self.one_hot_encoder,
+            f'{self.path_to_model_files}one_hot_encoder_{self.model_date}.pkl',
+            protocol=pickle.HIGHEST_PROTOCOL
+        )
+
         self.X_train = self.replace_dummy_columns_with_dummies(self.X_train)
 
         self.Y_train = self.user_profiles.loc[train_indices, 'outcome'].sort_index()
@@ -356,28 +377,34 @@ class PredictionModel(object):
 
         joblib.dump(
             self.scaler,
-            f'{self.path_to_model_files}scaler_{self.model_date}.pkl'
+            f'{self.path_to_model_files}scaler_{self.model_date}.pkl',
+            protocol=pickle.HIGHEST_PROTOCOL
         )
 
         if ModelArtifacts.USER_PROFILES.value not in self.artifacts_to_retain:
             self.artifact_handler(ModelArtifacts.USER_PROFILES)
 
-    def delete_existing_model_file_for_same_date(self, filename: str) -> datetime.date:
+    def delete_existing_model_file_for_same_date(self, filename: str, existing_files: Set[str] = None):
         '''
         Requires:
             - model_date
             - path_to_model_files
         Deletes model files should they already exist for the given date
+        :param filename:
+        :param existing_files: contents of path_to_model_files, can be passed in to list the directory only once when
+        deleting multiple files
         '''
         if filename != 'category_lists':
             suffix = 'pkl'
         else:
             suffix = 'json'
 
-        if self.path_to_model_files in os.listdir(None):
-            if f'scaler_{self.model_date}.pkl' in os.listdir(
-                    None if self.path_to_model_files == '' else self.path_to_model_files):
-                os.remove(f'{self.path_to_model_files}{filename}_{self.model_date}.{suffix}')
+        if existing_files is None:
+            existing_files = set(os.listdir(self.path_to_model_files or '.'))
+
+        model_file = f'{filename}_{self.model_date}.{suffix}'
+        if model_file in existing_files:
+            os.remove(f'{self.path_to_model_files}{model_file}')
 
     def preprocess_and_train(
             self,
@@ -392,8 +419,9 @@ class PredictionModel(object):
             - artifact_retention_mode
         Trains a new model given a full dataset
         '''
-        if 0 not in self.user_profiles['outcome'].unique():
-            self.user_profiles['outcome'] = self.le.transform(self.user_profiles['outcome'])
+        # Labels are only encoded once, an already encoded outcome column is numeric
+        if not pd.api.types.is_numeric_dtype(self.user_profiles['outcome']):
+            self.user_profiles['outcome'] = self.le.transform(self.user_profiles['outcome'].values)
 
         self.create_train_test_transformations()
         self.train_model(model_function, model_arguments)
@@ -415,14 +443,14 @@ class PredictionModel(object):
 
         logger.info('  * Model training complete, generating outcome frame')
 
-        try:
+        if hasattr(self.model, 'feature_importances_'):
             self.variable_importances = pd.Series(
                 data=self.model.feature_importances_,
                 index=self.X_train.columns
             )
-        except:
+        else:
             # This handles parameter tuning, when some model types may not have variable importance
-            self.variable_importances = pd.Series()
+            self.variable_importances = pd.Series(dtype=float)
 
         self.outcome_frame = self.create_outcome_frame(
             {'train': self.Y_train, },
@@ -566,8 +594,11 @@ class PredictionModel(object):
         self.user_profiles = self.user_profiles[~self.user_profiles['outcome'].isna()]
 
         if self.overwrite_files:
-            for model_file in ['category_lists', 'scaler', 'model']:
-                self.delete_existing_model_file_for_same_date(model_file)
+            # Same date as the one set when splitting train / test, which names the newly stored files
+            self.model_date = self.user_profiles['outcome_date'].max() + timedelta(days=1)
+            existing_files = set(os.listdir(self.path_to_model_files or '.'))
+            for model_file in ['category_lists', 'scaler', 'one_hot_encoder', 'model']:
+                self.delete_existing_model_file_for_same_date(model_file, existing_files)
 
         if sampling_function:
             try:
@@ -584,17 +615,19 @@ class PredictionModel(object):
 
         joblib.dump(
             self.model,
-            f'{self.path_to_model_files}model_{self.model_date}.pkl'
+            f'{self.path_to_model_files}model_{self.model_date}.pkl',
+            compress=MODEL_COMPRESSION,
+            protocol=pickle.HIGHEST_PROTOCOL
         )
 
         logger.info(f'Saved to {self.path_to_model_files}model_{self.model_date}.pkl')
 
         self.remove_model_training_artefacts()
         # TODO: This would eventually be replaced with storing variable importances to DB
-        self.variable_importances.to_csv(
-            f'{self.path_to_model_files}variable_importances_{self.model_date}.csv',
-            index=True,
-            header=False
+        joblib.dump(
+            self.variable_importances,
+            f'{self.path_to_model_files}variable_importances_{self.model_date}.pkl',
+            protocol=pickle.HIGHEST_PROTOCOL
         )
 
         if not self.dry_run:
@@ -686,20 +719,31 @@ class PredictionModel(object):
         Serves for the prediction pipeline in order to load model & additional transformation config objects
         '''
 
-        model_related_file_list = os.listdir(self.path_to_model_files)
         last_model_related_files = {}
-        for model_related_file in ['category_lists', 'scaler', 'model', 'variable_importances']:
-            last_file_date = {parse(re.sub(f'{model_related_file}_|.json|.pkl|.csv|None', '', filename)):
-                                  abs(parse(re.sub(f'{model_related_file}_|.json|.pkl|.csv|None', '', filename)).date()
-                                      - self.scoring_date.date())
-                              for filename in model_related_file_list
-                              if re.search(f'{model_related_file}_', filename)}
-            last_file_date = [date for date, diff in last_file_date.items() if diff == min(last_file_date.values())][0]
-            last_model_related_files[model_related_file] = last_file_date.date()
+        for model_related_file, extensions in MODEL_RELATED_FILE_EXTENSIONS.items():
+            # glob pre-filters the directory, the date is then sliced out of '<prefix>_<date>.<extension>'
+            file_dates = [
+                parse(os.path.basename(path)[len(model_related_file) + 1:-len(extension) - 1]).date()
+                for extension in extensions
+                for path in glob(f'{self.path_to_model_files or ""}{model_related_file}_*.{extension}')
+            ]
+            if not file_dates and model_related_file == 'one_hot_encoder':
+                # Models stored before the encoder get it fitted from their category lists
+                continue
+            if not file_dates:
+                raise ValueError(
+                    f'No {model_related_file} files found in {self.path_to_model_files or os.getcwd()}, '
+                    f'expected files named {model_related_file}_<YYYY-MM-DD>.{"/".join(extensions)}'
+                )
+            last_model_related_files[model_related_file] = min(
+                file_dates,
+                key=lambda file_date: abs(file_date - self.scoring_date.date())
+            )
         if len(set(last_model_related_files.values())) > 1:
             raise ValueError(f'''Unaligned model file dates
                 category_list date: {last_model_related_files['category_lists']}
                 scaler date: {last_model_related_files['scaler']}
+                one hot encoder date: {last_model_related_files.get('one_hot_encoder')}
                 model date: {last_model_related_files['model']}
                 'variable importances': {last_model_related_files['variable_importances']}
                 ''')
@@ -711,17 +755,33 @@ class PredictionModel(object):
             self.category_list_dict = json.load(outfile)
 
         self.scaler = joblib.load(f"{self.path_to_model_files}scaler_{str(last_model_related_files['scaler'])}.pkl")
+        if 'one_hot_encoder' in last_model_related_files:
+            self.one_hot_encoder = joblib.load(
+                f"{self.path_to_model_files}one_hot_encoder_{str(last_model_related_files['one_hot_encoder'])}.pkl"
+            )
+        else:
+            self.one_hot_encoder = None
         self.model = joblib.load(f"{self.path_to_model_files}model_{str(last_model_related_files['model'])}.pkl")
         # TODO: This would eventually be replaced with loading variable importances from DB
-        self.variable_importances = pd.read_csv(
-            f"{self.path_to_model_files}variable_importances_{str(last_model_related_files['variable_importances'])}.csv",
-            squeeze=True,
-            index_col=0,
-            header=None
-        )
+        self.variable_importances = self.load_variable_importances(last_model_related_files['variable_importances'])
 
         logger.info('  * Model constructs loaded')
 
+    def load_variable_importances(self, file_date) -> pd.Series:
+        '''
+        Requires:
+            - path_to_model_files
+        Loads the variable importances stored for a model date, models trained before the importances were pickled
+        stored them as a headerless CSV
+        :param file_date:
+        :return:
+        '''
+        path = f'{self.path_to_model_files}variable_importances_{file_date}'
+        if os.path.exists(f'{path}.pkl'):
+            return joblib.load(f'{path}.pkl')
+
+        return pd.read_csv(f'{path}.csv', index_col=0, header=None).iloc[:, 0].rename(None).rename_axis(None)
+
     def batch_predict(self, data):
         '''
         Requires: